@@ -1,8 +1,10 @@
 
-from .csdomain import CSharpDomain
+from .csdomain import CSharpDomain, log_parse_caches
 
 
 def setup(app):
   # Need to do this, as nose relies on this method existing
   if hasattr(app, "add_domain"):
-    app.add_domain(CSharpDomain)
\ No newline at end of file
+    app.add_domain(CSharpDomain)
+    app.connect("build-finished", log_parse_caches)
+  return {'parallel_read_safe': True, 'parallel_write_safe': True}
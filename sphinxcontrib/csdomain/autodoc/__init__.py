@@ -1,9 +1,45 @@
 
 
-from .directives import CSAutodocModule, CSAutodoc
+from .directives import CSAutodocModule, CSAutodoc, outdated_documents
+from .directives import merge_source_files, parse_declared_modules
+from .cache import DEFAULT_MAX_SIZE
+from .tree import DEFAULT_INCLUDE, DEFAULT_EXCLUDE
+from .source import reset_source_stats, log_source_stats, stop_file_states
 
 def setup(app):
   # Need to do this, as nose relies on this method existing
   if hasattr(app, "add_directive_to_domain"):
     app.add_directive_to_domain("cs", "autodoc", CSAutodoc)
-    app.add_directive_to_domain("cs", "autodocmodule", CSAutodocModule)
\ No newline at end of file
+    app.add_directive_to_domain("cs", "autodocmodule", CSAutodocModule)
+    app.connect("env-get-outdated", outdated_documents)
+    app.connect("env-before-read-docs", parse_declared_modules)
+    app.connect("env-merge-info", merge_source_files)
+    app.connect("builder-inited", reset_source_stats)
+    app.connect("build-finished", log_source_stats)
+    app.connect("build-finished", stop_file_states)
+
+    # Worker processes for parsing :tree: modules; 1 parses in-process,
+    # 0 uses one per CPU
+    app.add_config_value("cs_autodoc_parse_processes", 1, "env")
+
+    # Directory, relative to the source directory, to keep parsed files in
+    # between builds; unset disables the cache. Size limit is in bytes.
+    app.add_config_value("cs_autodoc_cache_dir", None, "env")
+    app.add_config_value("cs_autodoc_cache_size", DEFAULT_MAX_SIZE, "env")
+
+    # Globs picking the files of :tree: modules, matched against names or
+    # paths relative to the tree; excluded directories are not descended
+    # into. With projects set, directories holding a .csproj only
+    # contribute the files it compiles.
+    app.add_config_value("cs_autodoc_include", list(DEFAULT_INCLUDE), "env")
+    app.add_config_value("cs_autodoc_exclude", list(DEFAULT_EXCLUDE), "env")
+    app.add_config_value("cs_autodoc_projects", False, "env")
+
+    # Skip class bodies when parsing, recording where they are, and parse
+    # a class's members only when cs:autodoc first renders it
+    app.add_config_value("cs_autodoc_lazy_members", False, "env")
+
+    # Only index the namespaces and types of :tree: modules, from their
+    # headers, and parse a file in full once cs:autodoc renders a class in it
+    app.add_config_value("cs_autodoc_quick_index", False, "env")
+  return {'parallel_read_safe': True, 'parallel_write_safe': True}
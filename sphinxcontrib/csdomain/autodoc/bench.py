@@ -0,0 +1,167 @@
+# coding: utf-8
+"""Micro-benchmarks for the autodoc source parser.
+
+Run against one or more real C# files, e.g.::
+
+  python -m sphinxcontrib.csdomain.autodoc.bench path/to/Large.cs
+"""
+
+import re
+import os
+import sys
+import codecs
+import hashlib
+import timeit
+
+from .core import CoreParser
+from .parser import FileParser, opensafe
+from .source import load_source
+from .index import index_classes
+from .lexical import parse_documentation_lines
+
+# Probes of the kind FileParser.swallow_with_ws and friends issue constantly
+_SKIP_PROBES = ['{', '}', '(', ')', ';', ',', '::', '[', '=']
+_WORD_PROBES = ['class', 'namespace', 'using', 'public', 'static']
+
+def _uncached_skip(core, chars):
+  """CoreParser.skip as it was, compiling a fresh pattern per call"""
+  return core.match(re.compile(re.escape(chars)))
+
+def _uncached_skip_word(core, word):
+  return core.match(re.compile(r'\b%s\b' % re.escape(word)))
+
+def _probe_positions(contents, step=7):
+  return range(0, len(contents), step)
+
+def _run_skips(core, positions, skip, skip_word):
+  calls = 0
+  for pos in positions:
+    for chars in _SKIP_PROBES:
+      core.pos = pos
+      skip(chars)
+    for word in _WORD_PROBES:
+      core.pos = pos
+      skip_word(word)
+    calls += len(_SKIP_PROBES) + len(_WORD_PROBES)
+  return calls
+
+def bench_skip(contents, repeat=3):
+  """Returns (before, after) calls per second for skip/skip_word probes"""
+  core = CoreParser(contents)
+  positions = _probe_positions(core.definition)
+
+  def _rate(skip, skip_word):
+    best = None
+    for _ in range(repeat):
+      start = timeit.default_timer()
+      calls = _run_skips(core, positions, skip, skip_word)
+      elapsed = timeit.default_timer() - start
+      best = elapsed if best is None else min(best, elapsed)
+    return calls / best
+
+  before = _rate(lambda c: _uncached_skip(core, c),
+                 lambda w: _uncached_skip_word(core, w))
+  after = _rate(core.skip, core.skip_word)
+  return before, after
+
+def _load_as_was(filename):
+  """Source loading as it was: a stat, a read for the cache key, a peek at
+  the byte order mark, a decoding read and a stripped copy"""
+  os.stat(filename)
+  with open(filename, "rb") as f:
+    hashlib.sha1("0\0{}".format(f.read()))
+  with open(filename, "rb") as f:
+    bom = f.read(min(32, os.path.getsize(filename)))
+  encoding = "utf-8-sig" if bom.startswith(codecs.BOM_UTF8) else "utf-8"
+  return codecs.open(filename, "r", encoding=encoding).read().strip()
+
+def _load(filename):
+  with load_source(filename) as source:
+    hashlib.sha1("0\0").update(source.raw)
+    return source.text()
+
+def bench_load(filename, repeat=20):
+  """Returns (before, after) best times to stat, hash and decode a file"""
+  def best(load):
+    return min(timeit.repeat(lambda: load(filename), number=1, repeat=repeat))
+  return best(_load_as_was), best(_load)
+
+def bench_parse(contents, repeat=3, **kwargs):
+  """Returns the best wall-clock time for a full FileParser pass"""
+  return min(timeit.repeat(lambda: FileParser(contents, **kwargs).parse_file(),
+                           number=1, repeat=repeat))
+
+def bench_index(contents, repeat=3):
+  """Returns the best time to index the classes of a file"""
+  return min(timeit.repeat(lambda: index_classes(contents), number=1,
+                           repeat=repeat))
+
+def memo_stats(contents):
+  """Returns (hits, misses) of the packrat memo over one full parse"""
+  parser = FileParser(contents, memoize=True)
+  parser.parse_file()
+  return parser.memo_hits, parser.memo_misses
+
+def initialiser_source(elements=10000):
+  """A field whose array initialiser holds the given number of elements"""
+  values = ", ".join('"{0}" + ({0} * 2)'.format(i) for i in range(elements))
+  return u"public static object[] Values = new object[] {{ {} }};".format(values)
+
+def bench_initialiser(elements=10000, repeat=3):
+  """Returns the best time to parse one large array-initialised field"""
+  source = initialiser_source(elements)
+  return min(timeit.repeat(
+    lambda: FileParser(source)._parse_class_member_declaration(),
+    number=1, repeat=repeat))
+
+def documentation_comments(members=5000):
+  """Documentation comments of the kind each member of a large API carries"""
+  comment = [
+    "/// <summary>",
+    "/// Converts a <see cref=\"T:Space.Widget{{T}}\"/> for member {0}, using",
+    "/// <paramref name=\"value\"/> unless it is <c>null</c>.",
+    "/// </summary>",
+    "/// <remarks>Safe to call repeatedly.<para>See also the overloads.</para></remarks>",
+    "/// <typeparam name=\"T\">The element type</typeparam>",
+    "/// <param name=\"value\">The value to convert</param>",
+    "/// <returns>The converted <typeparamref name=\"T\"/></returns>",
+    "/// <exception cref=\"T:System.ArgumentException\">If it cannot be converted</exception>",
+    "/// <seealso cref=\"M:Space.Widget.Convert\"/>"]
+  return [[line.format(n) for line in comment] for n in range(members)]
+
+def bench_documentation(members=5000, repeat=3):
+  """Returns the best time to convert a documentation comment per member"""
+  comments = documentation_comments(members)
+  def run():
+    for parts in comments:
+      parse_documentation_lines(parts)
+  return min(timeit.repeat(run, number=1, repeat=repeat))
+
+def main(argv):
+  if not argv:
+    print "Usage: python -m sphinxcontrib.csdomain.autodoc.bench FILE.cs [...]"
+    return 1
+  print "10,000 element array initialiser: {:.3f}s".format(bench_initialiser())
+  print "5,000 documentation comments:     {:.3f}s".format(bench_documentation())
+  for filename in argv:
+    contents = opensafe(filename).read()
+    lines = len(contents.splitlines())
+    print "{} ({} lines)".format(filename, lines)
+    before, after = bench_load(filename)
+    print "  load:           {:.2f}ms as it was, {:.2f}ms in one read ({:.1f}x)".format(
+      before * 1000, after * 1000, before / after)
+    before, after = bench_skip(contents)
+    print "  skip/skip_word: {:,.0f} calls/s uncached, {:,.0f} calls/s cached ({:.1f}x)".format(
+      before, after, after / before)
+    print "  full parse:     {:.3f}s".format(bench_parse(contents))
+    print "  parsing bodies: {:.3f}s".format(bench_parse(contents, parse_bodies=True))
+    print "  lazy members:   {:.3f}s".format(bench_parse(contents, lazy_members=True))
+    print "  quick index:    {:.3f}s".format(bench_index(contents))
+    hits, misses = memo_stats(contents)
+    print "  memoized parse: {:.3f}s ({} hits, {} misses, {:.0%} hit rate)".format(
+      bench_parse(contents, memoize=True), hits, misses,
+      float(hits) / max(1, hits + misses))
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,139 @@
+# coding: utf-8
+"""Persistent cache of parsed source files.
+
+Entries are keyed on a hash of the raw file contents plus PARSER_VERSION,
+so they stay valid across checkouts and clean builds, and are dropped
+oldest-first once the directory grows past its size limit. Manage from the
+command line with::
+
+  python -m sphinxcontrib.csdomain.autodoc.cache prune DIRECTORY [MAX_BYTES]
+  python -m sphinxcontrib.csdomain.autodoc.cache clear DIRECTORY
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+import cPickle as pickle
+
+# Bump whenever the parser or the cached records change shape, so that old
+# entries stop matching
+PARSER_VERSION = 3
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+_SUFFIX = ".pickle"
+
+class ParseCache(object):
+  def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+    self.directory = directory
+    self.max_size = max_size
+
+  def key(self, raw, mode=""):
+    """The cache key for the raw (undecoded) contents of a source file,
+    as a string or an mmap, parsed in the given mode"""
+    # Hashed in place, rather than formatted into a copy of the contents
+    sha = hashlib.sha1("{}\0{}\0".format(PARSER_VERSION, mode))
+    sha.update(raw)
+    return sha.hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.directory, key + _SUFFIX)
+
+  def get(self, key):
+    """Returns the records stored under a key, or None"""
+    path = self._path(key)
+    try:
+      with open(path, "rb") as f:
+        value = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+      return None
+    # Mark as recently used, for eviction
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    return value
+
+  def put(self, key, value):
+    """Stores records under a key. Never fails the build over a cache write"""
+    temp = None
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      # Write then rename, so concurrent readers never see half an entry
+      fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+      with os.fdopen(fd, "wb") as f:
+        pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+      os.rename(temp, self._path(key))
+      temp = None
+    # Besides I/O errors, pickling raises RuntimeError for values nested too
+    # deeply and TypeError for unpicklable ones
+    except Exception as ex:
+      print "Warning: Could not write C# parse cache entry: {}".format(ex)
+    finally:
+      if temp is not None:
+        try:
+          os.remove(temp)
+        except OSError:
+          pass
+
+  def _entries(self):
+    """Returns (mtime, size, path) for every entry, oldest first"""
+    if not os.path.isdir(self.directory):
+      return []
+    entries = []
+    for name in os.listdir(self.directory):
+      if not name.endswith(_SUFFIX):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+    return sorted(entries)
+
+  def size(self):
+    return sum(size for (_, size, _) in self._entries())
+
+  def prune(self, max_size=None):
+    """Evicts least recently used entries until within max_size bytes.
+    Returns the number of entries removed."""
+    if max_size is None:
+      max_size = self.max_size
+    entries = self._entries()
+    total = sum(size for (_, size, _) in entries)
+    removed = 0
+    for (_, size, path) in entries:
+      if total <= max_size:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+      removed += 1
+    return removed
+
+  def clear(self):
+    """Removes every entry. Returns the number removed."""
+    return self.prune(0)
+
+def main(argv):
+  if len(argv) < 2 or argv[0] not in ("prune", "clear"):
+    print "Usage: python -m sphinxcontrib.csdomain.autodoc.cache prune DIRECTORY [MAX_BYTES]"
+    print "       python -m sphinxcontrib.csdomain.autodoc.cache clear DIRECTORY"
+    return 1
+  cache = ParseCache(argv[1])
+  if argv[0] == "clear":
+    removed = cache.clear()
+  else:
+    max_size = int(argv[2]) if len(argv) > 2 else None
+    removed = cache.prune(max_size)
+  print "Removed {} entries; {} bytes remain in {}".format(
+    removed, cache.size(), cache.directory)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
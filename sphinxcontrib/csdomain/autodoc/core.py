@@ -1,18 +1,56 @@
 # coding: utf-8
 from ..parser import DefinitionError
+from bisect import bisect_right
 import re
 
-_newline_re = re.compile(r'[\n\r]')
+_line_break_re = re.compile(r'\r\n|\r|\n')
 _not_newline_re = re.compile(r'[^\n\r]*')
 _whitespace_re = re.compile(r'\s+(?u)')
 
+# Compiled patterns for the literals, words and character classes that the
+# parsers ask for, built once per distinct argument rather than on every call
+_literal_cache = {}
+_word_cache = {}
+_not_chars_cache = {}
+
+def _literal_re(chars):
+  regex = _literal_cache.get(chars)
+  if regex is None:
+    regex = _literal_cache[chars] = re.compile(re.escape(chars))
+  return regex
+
+def _word_re(word):
+  regex = _word_cache.get(word)
+  if regex is None:
+    regex = _word_cache[word] = re.compile(r'\b%s\b' % re.escape(word))
+  return regex
+
+def _not_chars_re(chars):
+  regex = _not_chars_cache.get(chars)
+  if regex is None:
+    regex = _not_chars_cache[chars] = re.compile('[^{}]*'.format(re.escape(chars)))
+  return regex
+
+def _content_bounds(text):
+  """Offsets of the start and end of text without surrounding whitespace,
+  found without copying it as strip() would"""
+  start = 0
+  end = len(text)
+  while start < end and text[start].isspace():
+    start += 1
+  while end > start and text[end - 1].isspace():
+    end -= 1
+  return (start, end)
+
 class CoreParser(object):
   def __init__(self, definition):
-    self.definition = definition.strip()
-    self.pos = 0
-    self.end = len(self.definition)
+    # Parsed in place between the surrounding whitespace, so offsets and
+    # line numbers are those of the original text
+    self.definition = definition
+    (self.pos, self.end) = _content_bounds(definition)
     self.last_match = None
-    self._previous_state = (0, None)
+    self._previous_state = (self.pos, None)
+    self._line_starts = None
 
   def savepos(self):
     return (self.pos, self.last_match)
@@ -26,23 +64,38 @@ class CoreParser(object):
     self.backout()
     return value
 
+  @property
+  def line_starts(self):
+    """Offsets of the start of every line, built on first use"""
+    if self._line_starts is None:
+      self._line_starts = [0] + [m.end() for m in _line_break_re.finditer(self.definition)]
+    return self._line_starts
+
+  def line_of(self, pos):
+    """Returns the 1-based line number containing an offset"""
+    return bisect_right(self.line_starts, pos)
+
   @property
   def line_no(self):
-    return len(_newline_re.findall(self.definition[:self.pos]))+1
+    return self.line_of(self.pos)
+
+  @property
+  def col_no(self):
+    """The 0-based column of the current position"""
+    return self.pos - self.current_line_start_pos()
 
   def get_line(self, number= -1):
     if number < 0:
       return self.get_line(self.line_no)
-    return self.definition.splitlines()[number-1]
+    starts = self.line_starts
+    if number < 1 or number > len(starts):
+      raise IndexError("line number out of range")
+    end = starts[number] if number < len(starts) else len(self.definition)
+    return self.definition[starts[number-1]:end].rstrip('\r\n')
 
   def current_line_start_pos(self):
     """Returns the positional index of the start of the current line"""
-    # Walk backwards until at 0 or start of line
-    spos = self.pos
-    while spos >= 0:
-      if _newline_re.match(self.definition[spos]):
-        return spos+1
-      spos -= 1
+    return self.line_starts[self.line_no-1]
 
   def warn(self, message):
     print message
@@ -53,10 +106,15 @@ class CoreParser(object):
           .format(msg, self.pos, self.definition, " "*(self.pos)))
   
   def skip_word(self, word):
-    return self.match(re.compile(r'\b%s\b' % re.escape(word)))
+    # A word can only match if the text here starts with it
+    if not self.definition.startswith(word, self.pos, self.end):
+      return False
+    return self.match(_word_re(word))
 
   def skip(self, chars):
-    return self.match(re.compile(re.escape(chars)))
+    if not self.definition.startswith(chars, self.pos, self.end):
+      return False
+    return self.match(_literal_re(chars))
 
   def skip_with_ws(self, chars):
     if self.skip(chars):
@@ -75,13 +133,13 @@ class CoreParser(object):
 
   def skip_to_char(self, char):
     assert len(char) == 1
-    self.match(re.compile('[^{}]*'.format(char)))
+    self.match(_not_chars_re(char))
     value = self.matched_text
     self.skip_ws()
     return value
 
   def skip_to_any_char(self, chars):
-    self.match(re.compile('[^{}]*'.format(re.escape(chars))))
+    self.match(_not_chars_re(chars))
     value = self.matched_text
     self.skip_ws()
     return value
@@ -103,7 +161,7 @@ class CoreParser(object):
     self.pos, self.last_match = self._previous_state
 
   def match(self, regex):
-    match = regex.match(self.definition, self.pos)
+    match = regex.match(self.definition, self.pos, self.end)
     if match is not None:
       self._previous_state = (self.pos, self.last_match)
       self.pos = match.end()
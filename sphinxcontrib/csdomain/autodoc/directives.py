@@ -3,12 +3,57 @@
 from docutils.parsers.rst import directives
 from sphinx.util.compat import Directive
 import os
+import re
+import codecs
+import multiprocessing
+from functools import partial
 from docutils import nodes
 from docutils.statemachine import ViewList
 from xml.etree.ElementTree import ParseError
-from .parser import FileParser, opensafe
+from .parser import FileParser
+from .index import index_classes
+from .source import load_source, file_states, modification_time
+from .tree import TreeFilter
+from .cache import ParseCache
+from .records import summarize_class, class_digest, adopt_members
 import glob
 
+# A cs:autodocmodule directive in reStructuredText source, and its options
+_module_directive_re = re.compile(
+  r"^[ \t]*\.\.[ \t]+(?:cs:)?autodocmodule::[ \t]*(?P<argument>\S.*?)[ \t]*$"
+  r"(?P<options>(?:\n[ \t]+:[\w-]+:.*$)*)", re.M)
+
+def _class_suffixes(full_name):
+  """Every dotted suffix of a qualified class name, including the whole name"""
+  parts = full_name.split(".")
+  return [".".join(parts[i:]) for i in range(len(parts))]
+
+def _index_class(full_name, domaindata):
+  for suffix in _class_suffixes(full_name):
+    entries = domaindata['class_suffixes'].setdefault(suffix, [])
+    if full_name not in entries:
+      entries.append(full_name)
+
+def _unindex_class(full_name, domaindata):
+  suffixes = domaindata['class_suffixes']
+  for suffix in _class_suffixes(full_name):
+    entries = suffixes.get(suffix)
+    if entries and full_name in entries:
+      entries.remove(full_name)
+      if not entries:
+        del suffixes[suffix]
+
+def _find_classes(name, domaindata):
+  """Returns the qualified names of classes that a short or partially
+  qualified name could refer to, preferring exact class names"""
+  classes = domaindata['classes']
+  potential_names = domaindata['class_suffixes'].get(name, [])
+  if not potential_names:
+    # Allow partial names, e.g. Model for ViewModel
+    potential_names = sorted(x for x in classes.iterkeys() if x.endswith(name))
+  exact = [x for x in potential_names if classes[x].name == name]
+  return exact or list(potential_names)
+
 def _remove_source_file(filename, domaindata):
   """Remove all references to a source file"""
   namespaces = domaindata['namespaces']
@@ -16,56 +61,285 @@ def _remove_source_file(filename, domaindata):
   modules = domaindata['modules']
   if modules.has_key(filename):
     del modules[filename]
+  domaindata['indexed'].discard(filename)
   to_remove = []
-  for entry in (x for x in classes.itervalues() if x.compilation_unit == filename):
+  for full_name in domaindata['files'].pop(filename, []):
+    entry = classes.get(full_name)
+    # A partial class may since have been replaced from another file
+    if entry is None or entry.compilation_unit != filename:
+      continue
     to_remove.append(entry)
-    namespaces[str(entry.namespace)].remove(entry)
-  for entry in to_remove:
-    full_name = ".".join([str(entry.namespace), str(entry.name)])
     del classes[full_name]
+    bucket = namespaces[str(entry.namespace)]
+    del bucket[full_name]
+    if not bucket:
+      del namespaces[str(entry.namespace)]
+    _unindex_class(full_name, domaindata)
   if to_remove:
     print "Removed classes " + str([x.name for x in to_remove])
 
-def _parse_source_file(filename, domaindata):
-  """Parse, or re-parse, a source file. Returns a bool indicating changes"""
-  namespaces = domaindata['namespaces']
-  classes = domaindata['classes']
+def _is_stale(filename, domaindata, index=False):
+  """Whether a source file is missing, or changed since it was last parsed,
+  or was only indexed when a full parse is wanted"""
+  status = file_states.stat(filename)
+  if status is None:
+    return True
   modules = domaindata['modules']
-  
-  # import pdb
-  # pdb.set_trace()
-
-  if not os.path.isfile(filename):
-    # Just remove
-    _remove_source_file(filename)
+  if filename not in modules or modification_time(status) > modules[filename]:
     return True
+  return not index and filename in domaindata['indexed']
+
+def _indexes(filename, domaindata, index):
+  """Whether to only index a stale file; files once parsed in full, because
+  their classes were autodoc'd, are always parsed in full"""
+  return index and (filename not in domaindata['modules']
+                    or filename in domaindata['indexed'])
+
+def _parse_cache(env):
+  """The persistent parse cache configured for a build, if any"""
+  directory = env.config.cs_autodoc_cache_dir
+  if not directory:
+    return None
+  return ParseCache(os.path.join(env.srcdir, directory),
+                    env.config.cs_autodoc_cache_size)
+
+def _read_source_file(filename, cache=None, lazy=False, index=False):
+  """Parse a source file, returning (filename, mtime, classes, index). A
+  lazy parse leaves class members to be parsed when first used; an index
+  only finds the classes, leaving their members to a full parse.
+
+  Touches no shared state, so can run in a worker process."""
+  # One read serves both the cache key and the parse
+  with load_source(filename, file_states.stat(filename)) as source:
+    classes = None
+    if cache is not None:
+      key = cache.key(source.raw, "index" if index else "lazy" if lazy else "")
+      classes = cache.get(key)
+    if classes is None:
+      if index:
+        found = index_classes(source.text())
+      else:
+        parser = FileParser(source.text(), memoize=True, lazy_members=lazy)
+        found = parser.parse_file().iter_classes()
+      classes = [summarize_class(x) for x in found]
+      if cache is not None:
+        cache.put(key, classes)
+  for cls in classes:
+    cls.compilation_unit = filename
+  return (filename, source.mtime, classes, index)
 
-  stat = os.stat(filename)
-  mtime = max(stat.st_mtime, stat.st_ctime)
+def _read_queued(item, cache=None, lazy=False):
+  """_read_source_file for a (filename, index) pair, as queued for a pool"""
+  (filename, index) = item
+  return _read_source_file(filename, cache, lazy, index)
 
-  # If we have already parsed, check if we need to again
-  if filename in modules:
-    # Skip unchanged files
-    if mtime <= modules[filename]:
-      return False
+def _store_source_file(filename, mtime, parsed, index, domaindata):
+  """Replace everything known about a source file with freshly parsed, or
+  indexed, classes"""
+  namespaces = domaindata['namespaces']
+  classes = domaindata['classes']
+  modules = domaindata['modules']
 
   # Strip out all dictionary contents for this file
   _remove_source_file(filename, domaindata)
 
-  print "C# Autodoc Parsing {}".format(filename)
-
-  contents = opensafe(filename).read()
-  parser = FileParser(contents)
-  cu = parser.parse_file()
   modules[filename] = mtime
-  # Append every class to the namespaces dictionary
-  for cls in cu.iter_classes():
-    cls.compilation_unit = filename
-    namespaces[str(cls.namespace)].append(cls)
-    classes[".".join([str(cls.namespace), str(cls.name)])] = cls
+  if index:
+    domaindata['indexed'].add(filename)
+  file_classes = domaindata['files'][filename] = []
+  # Add every class to the namespaces dictionary
+  for cls in parsed:
+    full_name = ".".join([str(cls.namespace), str(cls.name)])
+    namespaces[str(cls.namespace)][full_name] = cls
+    classes[full_name] = cls
+    file_classes.append(full_name)
+    _index_class(full_name, domaindata)
+
+def _parse_source_file(filename, domaindata, cache=None, lazy=False,
+                       index=False):
+  """Parse, or re-parse, a source file. Returns a bool indicating changes"""
+  if file_states.stat(filename) is None:
+    # Just remove
+    _remove_source_file(filename, domaindata)
+    return True
 
+  # If we have already parsed, skip unchanged files
+  if not _is_stale(filename, domaindata, index):
+    return False
+
+  index = _indexes(filename, domaindata, index)
+  print "C# Autodoc {} {}".format("Indexing" if index else "Parsing", filename)
+  _store_source_file(*_read_source_file(filename, cache, lazy, index),
+                     domaindata=domaindata)
   return True
 
+def _parse_source_files(filenames, domaindata, processes=1, cache=None,
+                        lazy=False, indexable=()):
+  """Parse a set of source files, spreading the work over a process pool.
+  Returns a bool indicating changes. Files in indexable that have not been
+  parsed in full are only indexed.
+
+  Results are merged in sorted filename order, whatever order the workers
+  finish in, so the domain data does not depend on scheduling."""
+  filenames = sorted(filenames)
+  if processes == 0:
+    processes = multiprocessing.cpu_count()
+  stale = []
+  if processes > 1:
+    stale = [(x, _indexes(x, domaindata, x in indexable)) for x in filenames
+      if file_states.stat(x) is not None
+      and _is_stale(x, domaindata, x in indexable)]
+  changed = False
+  if len(stale) <= 1:
+    for filename in filenames:
+      changed |= _parse_source_file(filename, domaindata, cache, lazy,
+                                    filename in indexable)
+  else:
+    changed = True
+    print "C# Autodoc Parsing {} files with {} processes".format(
+      len(stale), processes)
+    pool = multiprocessing.Pool(min(processes, len(stale)))
+    try:
+      read = partial(_read_queued, cache=cache, lazy=lazy)
+      for result in pool.imap(read, stale):
+        _store_source_file(*result, domaindata=domaindata)
+    finally:
+      pool.terminate()
+      pool.join()
+    for filename in filenames:
+      if file_states.stat(filename) is None:
+        _remove_source_file(filename, domaindata)
+  # Entries are only added while parsing, so only need evicting afterwards
+  if changed and cache is not None:
+    cache.prune()
+  return changed
+
+def _tree_filter(env):
+  """Which files the :tree: modules of a build pick up"""
+  config = env.config
+  return TreeFilter(config.cs_autodoc_include, config.cs_autodoc_exclude,
+                    config.cs_autodoc_projects)
+
+def _module_paths(pattern, tree, tree_filter):
+  """The source files named by a cs:autodocmodule argument"""
+  if not tree:
+    return glob.glob(pattern)
+  files = set()
+  for filepath in glob.glob(pattern):
+    files.update(file_states.scan(filepath, tree_filter))
+  return files
+
+def _parse_module(env, paths, tree):
+  """Reads the source files of a cs:autodocmodule; trees may only need
+  indexing"""
+  indexable = ()
+  if tree and env.config.cs_autodoc_quick_index:
+    indexable = paths
+  _parse_source_files(paths, env.domaindata['cs'],
+    env.config.cs_autodoc_parse_processes, _parse_cache(env),
+    env.config.cs_autodoc_lazy_members, indexable)
+
+def _declared_modules(env, docname):
+  """The (path, tree) of every cs:autodocmodule in a document's source"""
+  try:
+    with codecs.open(env.doc2path(docname), "r",
+                     env.config.source_encoding) as f:
+      text = f.read()
+  except (IOError, UnicodeError):
+    return []
+  return [(env.relfn2path(match.group("argument"), docname)[1],
+           ":tree:" in match.group("options"))
+          for match in _module_directive_re.finditer(text)]
+
+def parse_declared_modules(app, env, docnames):
+  """Parses the modules declared by the documents about to be read.
+
+  Connected to env-before-read-docs. Parallel readers each start from a
+  copy of this environment, so a class parsed while reading one chunk of
+  documents could not be found by cs:autodoc in another. Parsing up front
+  also finds classes whatever order the documents are read in."""
+  if 'cs' not in env.domaindata:
+    return
+  tree_filter = _tree_filter(env)
+  for docname in docnames:
+    for (filename, tree) in _declared_modules(env, docname):
+      paths = _module_paths(filename, tree, tree_filter)
+      if paths:
+        _parse_module(env, paths, tree)
+
+def _rendered_digest(name, domaindata):
+  """Digest of the class a cs:autodoc name currently resolves to, or None"""
+  potentials = _find_classes(name, domaindata)
+  if not potentials:
+    return None
+  return class_digest(domaindata['classes'][potentials[0]])
+
+def outdated_documents(app, env, added, changed, removed):
+  """Brings parsed source files up to date before documents are read, and
+  returns the documents whose autodoc'd classes changed as a result.
+
+  Connected to env-get-outdated. Documents depend on the signatures and
+  documentation of the classes they render, not on whole source files,
+  so editing a method body re-reads nothing."""
+  # Every directive from here to the end of the build shares one snapshot
+  # of the source files, rather than stat'ing them again
+  file_states.start()
+  domaindata = env.domaindata.get('cs')
+  if not domaindata or not domaindata['modules']:
+    return []
+  # Everything parsed before, to catch deletions, plus the current contents
+  # of every declared module, to catch new files
+  paths = set(domaindata['modules'])
+  # Only files of :tree: modules may just be indexed, as in CSAutodocModule
+  indexable = set()
+  tree_filter = _tree_filter(env)
+  for modules in domaindata['module_docs'].itervalues():
+    for (pattern, tree) in modules:
+      found = _module_paths(pattern, tree, tree_filter)
+      paths.update(found)
+      if tree and env.config.cs_autodoc_quick_index:
+        indexable.update(found)
+  _parse_source_files(paths, domaindata,
+    env.config.cs_autodoc_parse_processes, _parse_cache(env),
+    env.config.cs_autodoc_lazy_members, indexable)
+  # Even with no source file changed, a class that could not be found may
+  # since have been parsed, by a module read after the document asking
+  outdated = []
+  for (docname, rendered) in domaindata['rendered'].iteritems():
+    if any(_rendered_digest(name, domaindata) != digest
+           for (name, digest) in rendered.iteritems()):
+      outdated.append(docname)
+  return outdated
+
+def merge_source_files(app, env, docnames, other):
+  """Adopts source files that a parallel reader parsed more recently.
+
+  Connected to env-merge-info. Readers start from a copy of this
+  environment, so anything they hold that is newer than ours was parsed
+  while reading."""
+  domaindata = env.domaindata['cs']
+  otherdata = other.domaindata['cs']
+  modules = domaindata['modules']
+  for (filename, mtime) in sorted(otherdata['modules'].iteritems()):
+    indexed = filename in otherdata['indexed']
+    # Files the reader parsed in full are newer than our index of them
+    if (filename in modules and modules[filename] >= mtime
+        and (indexed or filename not in domaindata['indexed'])):
+      continue
+    parsed = [x for x in (otherdata['classes'].get(name)
+                          for name in otherdata['files'].get(filename, []))
+              if x is not None and x.compilation_unit == filename]
+    _store_source_file(filename, mtime, parsed, indexed, domaindata)
+  # Members the reader parsed on first use, for classes it left unchanged
+  for (full_name, record) in otherdata['classes'].iteritems():
+    ours = domaindata['classes'].get(full_name)
+    if ours is not None and ours.compilation_unit == record.compilation_unit:
+      adopt_members(ours, record)
+  # Files the reader found to be deleted
+  for filename in sorted(modules):
+    if filename not in otherdata['modules'] and file_states.stat(filename) is None:
+      _remove_source_file(filename, domaindata)
+
 class CSAutodocModule(Directive):
   """
   Specifies the source file for autodoc
@@ -90,27 +364,16 @@ class CSAutodocModule(Directive):
 
     tree_opt = 'tree' in self.options
 
-    paths = []
-    if not tree_opt:
-      paths = glob.glob(filename)
-    else:
-
-      files = set()
-      for filepath in glob.glob(filename):
-        for (dirpath, _, filenames) in os.walk(filepath):
-          for filename in filenames:
-            if filename.endswith(".cs"):
-              files.add(os.path.join(dirpath, filename))
-      # print "Tree-walked: {}".format(files)
-      paths = files
-
+    paths = _module_paths(filename, tree_opt, _tree_filter(env))
     if not paths:
       raise IOError("Could not read any autodoc modules {}".format(paths))
 
-    # Read these files now
-    for filename in paths:
-      _parse_source_file(filename, domaindata)
-      self.state.document.settings.record_dependencies.add(filename)
+    # Usually parsed before reading started, so only checked here
+    _parse_module(env, paths, tree_opt)
+    # Later changes to the files are picked up by outdated_documents, rather
+    # than by re-reading this document
+    domaindata['module_docs'].setdefault(env.docname, []).append(
+      (filename, tree_opt))
 
     return []
 
@@ -141,10 +404,7 @@ class CSAutodoc(Directive):
       # Search the namespace dictionary for a class with this name
       # print "All Classes: " + str(", ".join(classes.keys()))
       # Look for a class with this name
-      potential_names = [x for x in classes.iterkeys() if x.endswith(todoc)]
-      potentials = [classes[x] for x in potential_names if classes[x].name == todoc]
-      if not potentials:
-        potentials = [classes[x] for x in potential_names]
+      potentials = [classes[x] for x in _find_classes(todoc, env.domaindata['cs'])]
 
       # print "Potentials: " + str(potentials)
       if len(potentials) == 0:
@@ -157,15 +417,20 @@ class CSAutodoc(Directive):
         print "ERROR: could not find unique class " + todoc
       return potentials[0]
 
+    rendered = env.domaindata['cs']['rendered'].setdefault(env.docname, {})
     obj = _find_class_by_name(todoc)
     if not obj:
+      # Re-read if the class turns up later
+      rendered[todoc] = None
       return []
     # Check the timestamp of the file this came from
     source = obj.compilation_unit
-    self.state.document.settings.record_dependencies.add(source)
-    # rescan this file (will not, if timestamps corrent)
-    if _parse_source_file(source, env.domaindata['cs']):
+    # rescan this file (will not, if timestamps corrent), or parse it in
+    # full if it was only indexed
+    if _parse_source_files([source], env.domaindata['cs'],
+        cache=_parse_cache(env), lazy=env.config.cs_autodoc_lazy_members):
       obj = _find_class_by_name(todoc)
+    rendered[todoc] = class_digest(obj)
     # if not os.path.isfile(source) or os.stat(source).st_mtime > modules[source]:
     #   # Re-parse, and re-find the class
     #   print "Re-scanning source file for {}".format(obj.name)
@@ -209,8 +474,7 @@ class CSAutodoc(Directive):
     if obj.documentation:
       lines.append("")
       try:
-        parsed = obj.documentation.parse_documentation()
-        lines.extend(parsed.splitlines())
+        obj.documentation.parse_documentation_lines(lines)
       except ParseError as ex:
         self.state_machine.reporter.warning(
           "Error parsing documentation comments for {}.{}: {}. Skipping intelligent parse.".format(
@@ -247,12 +511,11 @@ class CSAutodoc(Directive):
     if member.documentation:
       lines.append("")
       try:
-        parsed = member.documentation.parse_documentation()
-        lines.extend(parsed.splitlines())
+        member.documentation.parse_documentation_lines(lines)
       except ParseError as ex:
         self.state_machine.reporter.warning(
           "Error parsing documentation comments for {}.{}: {}. Skipping intelligent parse.".format(
-            obj.namespace, obj.name, ex.message)
+            member.namespace, member.name, ex.message)
           )
       
     full_definition = [decl] + ["    " + line for line in lines]
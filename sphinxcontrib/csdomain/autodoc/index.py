@@ -0,0 +1,155 @@
+# coding: utf-8
+"""A quick index of the types a C# source file declares.
+
+Rather than parsing a whole file, a single regular expression scan picks
+out namespace and type declarations, jumping over member bodies, enum
+bodies and delegates as balanced blocks or statements. Only the header of
+each type, from the end of the declaration before it to its opening brace,
+is handed to FileParser, so the classes found carry the same name,
+namespace, signature and documentation as a full parse gives them, but no
+members; those are left for a full parse of the file, when a class is
+autodoc'd."""
+
+import re
+from .lexical import find_block_end, coalesce_comments, Class
+from .parser import FileParser
+from ..parser import DefinitionError
+
+TYPE_KEYWORDS = ("class", "struct", "interface", "enum")
+
+# Words that can come before the keyword of a type declaration
+_CLASS_MODIFIERS = frozenset(("new", "public", "protected", "internal",
+  "private", "abstract", "sealed", "static", "partial"))
+
+_TOKENS = r"""
+    (?P<skip>
+      //[^\n\r]*
+    | /\*.*?\*/
+    | (?:@\$?|\$@)"(?:[^"]|"")*"
+    | "(?:[^"\\\n]|\\.)*"
+    | '(?:[^'\\\n]|\\.)*'
+    )
+  | (?P<directive>^[ \t]*\#[^\n\r]*)
+  # A lone =, rather than part of ==, =>, <= or +=
+  | (?P<assign>(?<![=!<>+\-*/%&|^])=(?![=>]))
+  | (?P<punct>[{}\[\];])
+  """
+_index_token_re = re.compile(_TOKENS + r"| (?P<word>@?[a-zA-Z_][a-zA-Z0-9_]*)",
+                             re.S | re.M | re.X)
+# Once a declaration is known to declare neither a namespace nor a type,
+# its words no longer matter
+_member_token_re = re.compile(_TOKENS, re.S | re.M | re.X)
+
+def _parse_header(header, class_type, name, nested):
+  """Parses the comments and header before a type's opening brace, as a
+  full parse would; headers the parser can't read keep just their name"""
+  parser = FileParser(header)
+  try:
+    parser.core.skip_ws()
+    comments = parser._parse_any(parser.lex.parse_comment)
+    clike = parser._parse_class_declaration_header()
+    # As in a full parse, documentation is only attached to the members of
+    # namespaces and classes, not to those of the compilation unit
+    if nested:
+      coalesce_comments(comments + [clike])
+  except DefinitionError:
+    clike = Class(name)
+    clike.class_type = class_type
+    clike.modifiers = []
+  # Nothing but the header was parsed
+  clike.members = None
+  return clike
+
+def index_classes(text):
+  """Returns the classes declared in a file's text, in the order that
+  iter_classes yields them from a full parse, with members set to None"""
+  classes = []
+  # Names of the enclosing namespaces and types
+  names = []
+  # The declaration being read: where it started, whether anything but
+  # modifiers and attributes has been seen, whether it has an initialiser,
+  # and the keyword and name of any namespace or type it declares
+  start = 0
+  other = False
+  assigned = False
+  declares = None
+  declared = []
+  brackets = 0
+  pos = 0
+  while True:
+    if other and declares is None:
+      match = _member_token_re.search(text, pos)
+    else:
+      match = _index_token_re.search(text, pos)
+    if match is None:
+      break
+    pos = match.end()
+    kind = match.lastgroup
+    token = match.group()
+    if kind == "skip":
+      continue
+    if kind == "directive":
+      if declares is None:
+        (start, other, assigned) = (pos, False, False)
+      continue
+    if kind == "word":
+      if declares is not None:
+        if declares == "namespace" or not declared:
+          declared.append(token)
+      elif brackets:
+        # Attribute arguments
+        pass
+      elif not other and (token == "namespace" or token in TYPE_KEYWORDS):
+        (declares, declared) = (token, [])
+        other = True
+      elif token not in _CLASS_MODIFIERS:
+        other = True
+      continue
+    if kind == "assign":
+      assigned = assigned or brackets == 0
+      continue
+    if token == "[":
+      brackets += 1
+    elif token == "]":
+      brackets = max(0, brackets - 1)
+    elif token == ";":
+      declares = None
+      (start, other, assigned) = (pos, False, False)
+    elif token == "}":
+      if names:
+        names.pop()
+      declares = None
+      (start, other, assigned) = (pos, False, False)
+    elif declares == "namespace":
+      names.append(".".join(declared))
+      declares = None
+      (start, other, assigned) = (pos, False, False)
+    elif declares is not None:
+      name = declared[0] if declared else None
+      clike = _parse_header(text[start:match.start()], declares, name,
+                            bool(names))
+      clike.namespace = ".".join(names)
+      classes.append(clike)
+      if declares == "enum":
+        # Enum members declare nothing
+        pos = find_block_end(text, match.start())
+        if pos is None:
+          break
+      else:
+        names.append(clike.name)
+      declares = None
+      (start, other, assigned) = (pos, False, False)
+    else:
+      # A member body, or an initialiser's braces
+      end = find_block_end(text, match.start())
+      if end is None:
+        break
+      pos = end
+      if not assigned:
+        following = _index_token_re.search(text, pos)
+        while following is not None and following.lastgroup == "skip":
+          following = _index_token_re.search(text, following.end())
+        # Properties with an initialiser carry on to the semicolon
+        if following is None or following.lastgroup != "assign":
+          (start, other, assigned) = (pos, False, False)
+  return classes
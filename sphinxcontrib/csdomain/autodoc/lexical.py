@@ -2,6 +2,8 @@
 
 import re
 import codecs
+from array import array
+from .core import _whitespace_re
 from .xmldoc import XmldocParser
 
 _identifier_re = re.compile(r'(~?\b[a-zA-Z_][a-zA-Z0-9_]*)\b')
@@ -82,13 +84,25 @@ class Comment(NamedDefinition):
     return self.parts[0].startswith("/")
 
   def parse_documentation(self):
-    # Grab the leading indentation from the first line
-    index = len(_doc_comment_skip_re.match(self.parts[0]).group())
-    # Strip this from the others
-    stripped = [x[index:] for x in self.parts]
-    # Rejoin these
-    fulltext = "\n".join(stripped)
-    return XmldocParser(fulltext).parse()
+    return parse_documentation_parts(self.parts)
+
+  def parse_documentation_lines(self, out=None):
+    return parse_documentation_lines(self.parts, out)
+
+def parse_documentation_parts(parts):
+  """Converts the lines of a documentation comment to reStructuredText"""
+  return "\n".join(parse_documentation_lines(parts))
+
+def parse_documentation_lines(parts, out=None):
+  """Appends the reStructuredText lines for a documentation comment to out,
+  or a new list, and returns it"""
+  # Grab the leading indentation from the first line
+  index = len(_doc_comment_skip_re.match(parts[0]).group())
+  # Strip this from the others
+  stripped = [x[index:] for x in parts]
+  # Rejoin these
+  fulltext = "\n".join(stripped)
+  return XmldocParser(fulltext).parse_lines(out)
 
 
 class SeparatedNameList(NamedDefinition):
@@ -179,6 +193,8 @@ class Space(NamedDefinition):
 
 class Class(Space):
   bases = None
+  # (start, end) offsets of the braces around a body left unparsed
+  body = None
 
   def __init__(self, name, form=None):
     super(Class, self).__init__(name, form)
@@ -222,6 +238,7 @@ class Member(NamedDefinition):
 class Method(Member):
   partial = False
   type = False
+  parameters = ()
   def signature(self):
     sig = []
     sig.extend(self.attributes)
@@ -543,7 +560,165 @@ class LexicalParser(object):
     return parsed
 
 
-
+# Token kinds recorded by TokenStream
+TOKEN_IDENTIFIER = 0
+TOKEN_KEYWORD = 1
+TOKEN_CHARACTER_LITERAL = 2
+TOKEN_STRING_LITERAL = 3
+TOKEN_OPERATOR = 4
+
+def token_kind(token):
+  """Classifies a token as returned by LexicalParser.parse_token"""
+  if isinstance(token, basestring):
+    if token in KEYWORDS:
+      return TOKEN_KEYWORD
+    return TOKEN_IDENTIFIER
+  if "character-literal" in token.definitions:
+    return TOKEN_CHARACTER_LITERAL
+  if "string-literal" in token.definitions:
+    return TOKEN_STRING_LITERAL
+  return TOKEN_OPERATOR
+
+# Single-pass equivalents of the LexicalParser rules, used by TokenStream.
+# Each only matches where the corresponding LexicalParser method would
+# produce the same element; anything else is left to LexicalParser itself.
+_stream_line_comment_re = re.compile(r'//[^\n\r]*\s*(?u)')
+_stream_directive_re = re.compile(r'#[^\n\r]*\s*(?u)')
+_stream_character_re = re.compile(r"""'([^'\n\\]|\\['"\\0abfnrtvxuU][^']*)'""")
+_stream_string_re = re.compile(r'"((?:[^"\\\n]|\\[\'"\x00abfnrtvxuU])*)"')
+_stream_verbatim_re = re.compile(r'@"((?:[^"]|"")*)"(?!")')
+_stream_operator_re = re.compile("|".join(re.escape(x) for x in
+  sorted(OPERATOR_OR_PUNCTUATOR, key=len, reverse=True)))
+
+class TokenStream(object):
+  """Lexes a whole definition once into compact token arrays.
+
+  Tokens are stored as parallel kind/start/end/text arrays, with comments
+  and pre-processor directives kept separately as (start, end) spans. Every
+  position the lexer passed through maps to the index of the next token, so
+  a parser can look up what LexicalParser.parse_next_token would return at
+  that position without lexing it again. Positions the stream never visited
+  (or could not lex) return None, and should be lexed directly."""
+
+  def __init__(self, definition):
+    self.kinds = array('B')
+    self.starts = array('l')
+    self.ends = array('l')
+    self.texts = []
+    self.comments = []
+    self.directives = []
+    self._index_at = {}
+    self._tokenize(definition)
+
+  def __len__(self):
+    return len(self.texts)
+
+  def _tokenize(self, text):
+    interned = {}
+    pending = []
+    pos = 0
+    end = len(text)
+    while pos < end:
+      start = pos
+      char = text[pos]
+      kind = None
+      value = None
+      match = _whitespace_re.match(text, pos)
+      if match:
+        pos = match.end()
+      elif text.startswith("//", pos):
+        pos = _stream_line_comment_re.match(text, pos).end()
+        self.comments.append((start, pos))
+      elif text.startswith("/*", pos):
+        close = text.find("*/", pos + 2)
+        if close >= 0:
+          pos = close + 2
+          match = _whitespace_re.match(text, pos)
+          if match:
+            pos = match.end()
+          self.comments.append((start, pos))
+      elif char == "#":
+        line_start = max(text.rfind("\n", 0, pos), text.rfind("\r", 0, pos)) + 1
+        if not text[line_start:pos].strip() and not text[pos+1:pos+2].isspace():
+          pos = _stream_directive_re.match(text, pos).end()
+          self.directives.append((start, pos))
+      else:
+        prefix = pos + 1 if char == "@" else pos
+        match = _identifier_re.match(text, prefix)
+        if match:
+          value = text[start:match.end()]
+          kind = TOKEN_KEYWORD if value in KEYWORDS else TOKEN_IDENTIFIER
+          pos = match.end()
+          match = _whitespace_re.match(text, pos)
+          if match:
+            pos = match.end()
+        else:
+          if char == "'":
+            match = _stream_character_re.match(text, pos)
+            kind = TOKEN_CHARACTER_LITERAL
+          elif char == '"':
+            match = _stream_string_re.match(text, pos)
+            kind = TOKEN_STRING_LITERAL
+          elif char == "@":
+            match = _stream_verbatim_re.match(text, pos)
+            kind = TOKEN_STRING_LITERAL
+          else:
+            match = _stream_operator_re.match(text, pos)
+            kind = TOKEN_OPERATOR
+          if match:
+            value = match.group(match.lastindex or 0)
+            pos = match.end()
+
+      if pos == start:
+        # Not something we can reproduce here; the live lexer will decide
+        pending = []
+        pos = start + 1
+        continue
+      pending.append(start)
+      if value is None:
+        continue
+      index = len(self.texts)
+      self.kinds.append(kind)
+      self.starts.append(start)
+      self.ends.append(pos)
+      self.texts.append(interned.setdefault(value, value))
+      for chain_pos in pending:
+        self._index_at[chain_pos] = index
+      pending = []
+
+  def index_at(self, pos):
+    """Returns the index of the next token from a position, if known"""
+    return self._index_at.get(pos)
+
+  def token(self, index):
+    """Returns (kind, text, end) for a token index"""
+    return (self.kinds[index], self.texts[index], self.ends[index])
+
+
+# Everything that can hide a brace inside a body: comments, verbatim and
+# regular strings, character literals - plus the braces themselves
+_block_scan_re = re.compile(r"""
+    [{}]
+  | //[^\n\r]*
+  | /\*.*?\*/
+  | (?:@\$?|\$@)"(?:[^"]|"")*"
+  | "(?:[^"\\\n]|\\.)*"
+  | '(?:[^'\\\n]|\\.)*'
+  """, re.S | re.X)
+
+def find_block_end(text, pos):
+  """Returns the index just past the '}' matching the '{' at pos, or None"""
+  assert text[pos] == '{'
+  depth = 0
+  for match in _block_scan_re.finditer(text, pos):
+    token = match.group()
+    if token == '{':
+      depth += 1
+    elif token == '}':
+      depth -= 1
+      if depth == 0:
+        return match.end()
+  return None
 
 def coalesce_comments(members):
   """Coalesces consecutive comments"""
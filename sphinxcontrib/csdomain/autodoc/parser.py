@@ -1,29 +1,28 @@
 # coding: utf-8
 
 import re
-import codecs
-import os
+import io
 
 
 from ..parser import DefinitionParser, DefinitionError
 from ..types import ClassInfo
 from .core import CoreParser
+from .source import load_source
 import lexical
 from .lexical import *
 
-def opensafe(filename, mode = 'r'):
-  bytes = min(32, os.path.getsize(filename))
-  raw = open(filename, 'rb').read(bytes)
-
-  if raw.startswith(codecs.BOM_UTF8):
-    encoding = 'utf-8-sig'
-  else:
-    print "Warning: Assuming utf-8 when no BOM on " + filename
-    encoding = 'utf-8'
-    # result = chardet.detect(raw)
-    # encoding = result['encoding']
+# Characters that can open or close a balanced expression, or start a
+# literal or comment that has to be stepped over
+_expression_delimiter_re = re.compile(r'''[()\[\]{};/"'@]''')
+_closing_brackets = {')': '(', ']': '[', '}': '{'}
+# Anything that could declare a nested type, which has to be found up front
+_nested_type_re = re.compile(r'\b(?:class|struct|interface|enum)\b')
 
-  return codecs.open(filename, mode, encoding=encoding)
+def opensafe(filename, mode = 'r'):
+  """Opens a source file as unicode text, decoded by its byte order mark.
+  The file is only ever read, so mode is accepted but ignored."""
+  with load_source(filename) as source:
+    return io.StringIO(source.text())
 
 
 class BasicFormInfo(object):
@@ -60,18 +59,61 @@ class NamespaceStack(object):
     ns.parts = self._stack[:]
     return ns
 
+def packrat(rule):
+  """Memoizes a FileParser rule on its start position, when enabled.
+
+  The result (or DefinitionError) is stored with the end position, so a
+  later attempt at the same position is answered without re-parsing.
+  Each attempt gets a list of its own, but the objects in it, and a single
+  object result, are shared: once a memoized rule has returned them, they
+  must never be changed, only read or replaced."""
+  name = rule.__name__
+  def _memoized(self, *args):
+    if self._memo is None:
+      return rule(self, *args)
+    key = (name, self.core.pos) + tuple(
+      tuple(x) if isinstance(x, list) else x for x in args)
+    entry = self._memo.get(key)
+    if entry is None:
+      self.memo_misses += 1
+      try:
+        result = rule(self, *args)
+      except DefinitionError as ex:
+        self._memo[key] = (None, ex, None)
+        raise
+      entry = self._memo[key] = (result, None, self.core.savepos())
+      return result
+    self.memo_hits += 1
+    (result, error, state) = entry
+    if error is not None:
+      raise error
+    self.core.restorepos(state)
+    if isinstance(result, list):
+      return list(result)
+    return result
+  _memoized.__name__ = name
+  _memoized.__doc__ = rule.__doc__
+  return _memoized
+
 class FileParser(object):
   core = None
   lex = None
   namespace = None
   _debug = False
 
-  def __init__(self, definition):
+  def __init__(self, definition, memoize=False, parse_bodies=False,
+               lazy_members=False):
     self.core = CoreParser(definition)
     self.lex = LexicalParser(self.core)
     self.namespace = NamespaceStack()
     self.opt =  self.core.opt
     self._parsing = None
+    self._tokens = None
+    self._memo = {} if memoize else None
+    self.parse_bodies = parse_bodies
+    self.lazy_members = lazy_members
+    self.memo_hits = 0
+    self.memo_misses = 0
 
   def first_of(self, parsers, msg=None):
     for parser in parsers:
@@ -91,17 +133,58 @@ class FileParser(object):
     # print "Classes: " + str(list(cu.iter_classes()))
     return cu
 
+  def parse_members(self, body, class_type, namespace):
+    """Parses the members of a class whose body a lazy parse skipped, given
+    its body span and the namespace its members are in. Returns None if
+    the span no longer holds a balanced body."""
+    (start, end) = body
+    definition = self.core.definition
+    if (definition[start:start + 1] != '{'
+        or lexical.find_block_end(definition, start) != end + 1):
+      return None
+    self.core.pos = start
+    self.namespace.push(namespace)
+    try:
+      self.swallow_with_ws('{')
+      members = self._parse_class_members(class_type)
+      (_, text, token_end) = self._next_token()
+      if (text, token_end) != ('}', end + 1):
+        raise DefinitionError(u"Could not parse class member at line {}: {}"
+          .format(self.core.line_no, self.core.get_line()))
+    finally:
+      self.namespace.pop()
+    return coalesce_comments(members)
+
+  @property
+  def tokens(self):
+    """The TokenStream for the whole definition, lexed on first use"""
+    if self._tokens is None:
+      self._tokens = TokenStream(self.core.definition)
+    return self._tokens
+
+  def _next_token(self):
+    """Returns (kind, text, end) for the next token, skipping comments.
+
+    Looked up in the token stream where possible, and otherwise lexed from
+    the current position without moving it."""
+    index = self.tokens.index_at(self.core.pos)
+    if index is not None:
+      return self.tokens.token(index)
+    state = self.core.savepos()
+    nexttok = self.lex.parse_next_token()
+    end = self.core.pos
+    self.core.restorepos(state)
+    return (lexical.token_kind(nexttok), unicode(nexttok), end)
+
   def swallow_with_ws(self, char):
     """Skips a character and any trailing whitespace, but raises DefinitionError if not found"""
     # Verify that the char is in the operator-or-punctuators
     assert char in lexical.OPERATOR_OR_PUNCTUATOR
-    state = self.core.savepos()
-    nexttok = self.lex.parse_next_token()
-    # print str(nexttok), char
-    if str(nexttok) == char:
+    (_, text, end) = self._next_token()
+    if text == char:
+      self.core.pos = end
       self.core.skip_ws()
       return True
-    self.core.restorepos(state)
     if not self.core.skip_with_ws(char):
       if not self.core.eof:
         raise DefinitionError(u"Unexpected token: '{}'; Expected '{}'".format(self.cur_line(), char))
@@ -110,12 +193,11 @@ class FileParser(object):
 
   def swallow_word_and_ws(self, word):
     # Skip any comments
-    state = self.core.savepos()
-    nexttok = self.lex.parse_next_token()
-    if nexttok == word:
+    (kind, text, end) = self._next_token()
+    if kind in (lexical.TOKEN_IDENTIFIER, lexical.TOKEN_KEYWORD) and text == word:
+      self.core.pos = end
       self.core.skip_ws()
       return True
-    self.core.restorepos(state)
     if not self.core.eof:
       raise DefinitionError(u"Unexpected token: '{}'; Expected '{}'".format(self.cur_line(), word))
     else:
@@ -284,6 +366,7 @@ class FileParser(object):
 
   ## B.2.2 Types ####################################
 
+  @packrat
   def _parse_type(self):
     
     state = self.core.savepos()
@@ -426,6 +509,24 @@ class FileParser(object):
     b.parts = statements
     return b
   
+  def _skip_block(self):
+    """Jumps over a block to its matching brace, without reading statements"""
+    if self.core.next_char != '{':
+      raise DefinitionError("Expected block")
+    end = lexical.find_block_end(self.core.definition, self.core.pos)
+    if end is None:
+      raise DefinitionError("Unterminated block")
+    b = Block('block', self.core.definition[self.core.pos:end])
+    self.core.pos = end - 1
+    self.swallow_with_ws('}')
+    return b
+
+  def _parse_body(self):
+    """A method or accessor body; only fully parsed if parse_bodies is set"""
+    if self.parse_bodies:
+      return self._parse_block()
+    return self._skip_block()
+
   def _parse_empty_statement(self):
     self.swallow_with_ws(';')
     return Statement('empty-statement', ';')
@@ -680,13 +781,10 @@ class FileParser(object):
 
       # Class body
       # print "Line: " + self.core.definition[self.core.pos:self.core.pos+30]
-      self.swallow_with_ws('{')
-      if clike.class_type in ('class', 'struct', 'interface'):
-        clike.members = self._parse_any_class_member_declarations()
-      elif clike.class_type in ('enum',):
-        clike.members = self._parse_any_enum_member_declarations()
-
-      self.swallow_with_ws('}')
+      if not (self.lazy_members and self._skip_class_body(clike)):
+        self.swallow_with_ws('{')
+        clike.members = self._parse_class_members(clike.class_type)
+        self.swallow_with_ws('}')
       self.core.skip_with_ws(";")
       # print "Parsed {} {}".format(clike.class_type, clike.name)
     except:
@@ -703,6 +801,29 @@ class FileParser(object):
     # print "Post-Coalescing"
     return clike
 
+  def _parse_class_members(self, class_type):
+    if class_type in ('class', 'struct', 'interface'):
+      return self._parse_any_class_member_declarations()
+    elif class_type in ('enum',):
+      return self._parse_any_enum_member_declarations()
+    return []
+
+  def _skip_class_body(self, clike):
+    """Jumps over a class body, keeping its span in clike.body so that the
+    members can be parsed later. Bodies that might declare nested types
+    are left to be parsed now, so that every class is found."""
+    definition = self.core.definition
+    start = self.core.pos
+    if definition[start:start + 1] != '{':
+      return False
+    end = lexical.find_block_end(definition, start)
+    if end is None or _nested_type_re.search(definition, start + 1, end - 1):
+      return False
+    clike.body = (start, end - 1)
+    self.core.pos = end
+    self.core.skip_ws()
+    return True
+
   def _parse_type_parameter_list(self):
     self.swallow_with_ws('<')
     params = self._parse_any(self._parse_type_parameter, ",")
@@ -860,7 +981,7 @@ class FileParser(object):
     self._parsing = "method-declaration"
 
     m = self._parse_method_header()
-    m.body = self.opt(self._parse_block)
+    m.body = self.opt(self._parse_body)
     if not m.body:
       self.swallow_with_ws(';')
 
@@ -994,7 +1115,7 @@ class FileParser(object):
     m = Member("Event-accessor-declaration")
     m.attributes = self._parse_any_attributes()
     m.accessor = self.swallow_one_of(['add', 'remove'])
-    m.contents = self._parse_block()
+    m.contents = self._parse_body()
     return m
 #   add-accessor-declaration: attributesopt add block
 # remove-accessor-declaration: attributesopt remove block
@@ -1029,7 +1150,7 @@ class FileParser(object):
     m.attributes = self._parse_any_attributes()
     m.modifiers = self._parse_any_modifiers(['protected', 'internal', 'private'])
     m.accessor = self.swallow_one_of(['get', 'set'])
-    m.body = self.opt(self._parse_block)
+    m.body = self.opt(self._parse_body)
     if not m.body:
       self.swallow_with_ws(';')
     m.definitionname = '{}-accessor-declaration'.format(m.accessor)
@@ -1098,7 +1219,7 @@ class FileParser(object):
     self.swallow_with_ws(')')
 
     # Parse the body
-    m.body = self.opt(self._parse_block)
+    m.body = self.opt(self._parse_body)
     if not m.body:
       self.swallow_with_ws(';')
 
@@ -1131,7 +1252,7 @@ class FileParser(object):
     if not static:
       m.initialiser = self.opt(self._parse_constructor_initialiser)
 
-    m.body = self.opt(self._parse_block)
+    m.body = self.opt(self._parse_body)
     if not m.body:
       self.swallow_with_ws(';')
     return m
@@ -1211,78 +1332,51 @@ class FileParser(object):
     return self._parse_balanced_expression()
 
   def _parse_balanced_expression(self):
+    """Reads an expression up to an unmatched closing bracket or a top-level ;
 
-    DBG = False
-    #if self.core.line_no == 33 and self._debug:
-    #   import pdb
-    #   pdb.set_trace()
-    #   DBG = True
-    
-    # if self.cur_line().startswith("using (var conn = new NpgsqlC"):
-    #   DBG = True
-    counts = {"{-}": 0, "(-)": 0, "[-]": 0, "-;-": 0, '-/-': 0, '-"-': 0}
-    tomatch = "()[]{};/\"'@"
-    expr = u""
-    start_pos = self.core.pos
+    Literals and comments are stepped over whole, so brackets inside them do
+    not count. Returns the source text of the expression."""
+    core = self.core
+    depth = {'(': 0, '[': 0, '{': 0}
+    start_pos = core.pos
     while True:
-      expr += self.core.skip_to_any_char(tomatch)
-      nextmatch = self.core.next_char
-      if DBG:
-        print "Read part expression: " + repr(expr)
-        print "  Next Character:  " + nextmatch
-        print "  Line: {}".format(self.core.line_no)
-
-      if not nextmatch:
+      match = _expression_delimiter_re.search(core.definition, core.pos, core.end)
+      if match is None:
+        core.pos = core.end
         raise RuntimeError("could not parse expression properly")
-      
+      core.pos = match.start()
+      nextmatch = match.group()
+
       if nextmatch == "'":
-        expr += u"'" + unicode(self.lex.parse_character_literal())
+        self.lex.parse_character_literal()
         continue
       if nextmatch in '"@':
-        literal = self.lex.parse_string_literal()
-        if literal:
-          expr += unicode(literal)
-        else:
-          expr += self.core.pop_char()
+        if not self.lex.parse_string_literal():
+          core.pos += 1
         continue
-
-      # If nextmatch is /, try to parse a comment
-      if self.lex.parse_comment():
-        # print "Parsed comment from balanced expression"
-        expr += "// comment"
+      if nextmatch == '/':
+        if not self.lex.parse_comment():
+          core.pos += 1
         continue
-      # Find the tracking entry corresponding to this
-      index = next(x for x in counts.iterkeys() if nextmatch in x)
-      if DBG:
-        print "  Found index: " + index
-      counts[index] -= index.index(nextmatch)-1
-      if DBG:
-        print "  " + str(counts)
-
-      if nextmatch == ",":
-        import pdb
-        pdb.set_trace()      
-      if any(x < 0 for x in counts.itervalues()) \
-        or (all(x <= 0 for x in counts.itervalues()) and nextmatch in [',', ';']):
-        # print "Breaking expression!"
-        if DBG:
-          print "Parsed balanced expression: " + expr
-        break
-      # Attach the next character
-      expr += nextmatch
-      self.core.skip(nextmatch)
-
-    if self.core.pos == start_pos:
-      # print "Statement went nowhere"
+
+      if nextmatch == ';':
+        if not any(depth.itervalues()):
+          break
+      elif nextmatch in depth:
+        depth[nextmatch] += 1
+      else:
+        opening = _closing_brackets[nextmatch]
+        depth[opening] -= 1
+        if depth[opening] < 0:
+          break
+      core.pos += 1
+
+    if core.pos == start_pos:
       return None
-    # if expr == "":
-    #   import pdb
-    #   pdb.set_trace()
-    #   return None
-    return NamedDefinition('expression', expr)
+    return NamedDefinition('expression', core.definition[start_pos:core.pos])
 
-    # raise Exception("Not processing expressions")
 
+  @packrat
   def _parse_any_attributes(self):
     return self._parse_any(self._parse_attribute_section)
 
@@ -1347,6 +1441,7 @@ class FileParser(object):
                    'extern')
     return self._parse_any_modifiers(valid)
 
+  @packrat
   def _parse_any_modifiers(self, valid_modifiers):
     fun = lambda: self._parse_modifier(valid_modifiers)
     return self._parse_any(fun)
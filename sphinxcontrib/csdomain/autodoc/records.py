@@ -0,0 +1,175 @@
+# coding: utf-8
+"""Compact summaries of parsed classes, as kept in the Sphinx environment.
+
+The parse tree from FileParser holds member bodies, whitespace and every
+intermediate definition; autodoc only needs signatures, namespaces and
+documentation comments, so that is all these keep. Classes from a lazy
+parse keep the span of their body instead of members, and parse them from
+the source file when they are first asked for; classes that were only
+indexed find theirs with a full parse of the file."""
+
+import hashlib
+from collections import OrderedDict
+from .lexical import parse_documentation_parts, parse_documentation_lines
+from .parser import FileParser
+from .source import load_source, file_states, modification_time
+
+class _Record(object):
+  __slots__ = ()
+
+  def __init__(self, *values):
+    for (name, value) in zip(self.__slots__, values):
+      setattr(self, name, value)
+
+  # Pickle as a bare tuple of slot values
+  def __getstate__(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __setstate__(self, state):
+    for (name, value) in zip(self.__slots__, state):
+      setattr(self, name, value)
+
+  def __repr__(self):
+    return "<{}: {}>".format(type(self).__name__, self._signature)
+
+  def signature(self):
+    return self._signature
+
+class DocumentationRecord(object):
+  """The raw lines of a documentation comment"""
+  __slots__ = ("parts",)
+
+  def __init__(self, parts):
+    self.parts = parts
+
+  def __getstate__(self):
+    return self.parts
+
+  def __setstate__(self, state):
+    self.parts = state
+
+  def parse_documentation(self):
+    return parse_documentation_parts(self.parts)
+
+  def parse_documentation_lines(self, out=None):
+    return parse_documentation_lines(self.parts, out)
+
+class MemberRecord(_Record):
+  __slots__ = ("name", "namespace", "_signature", "documentation")
+
+class ClassRecord(_Record):
+  __slots__ = ("name", "namespace", "_signature", "documentation", "_members",
+               "compilation_unit", "body")
+
+  @property
+  def members(self):
+    """Member records, parsed on first use if the body was skipped"""
+    if self._members is None:
+      self._members = _parse_members(self)
+    return self._members
+
+def _text(value):
+  # Interned, so that the many members sharing a namespace share one string,
+  # and pickles refer back to it rather than repeating it
+  return "" if value is None else intern(str(value))
+
+def _summarize_documentation(documentation):
+  if documentation is None:
+    return None
+  return DocumentationRecord(list(documentation.parts))
+
+def summarize_member(member):
+  return MemberRecord(_text(member.name),
+    _text(getattr(member, "namespace", None)), member.signature(),
+    _summarize_documentation(member.documentation))
+
+def _summarize_members(members):
+  # Stray comments and directives end up amongst the members, but only
+  # declarations have a signature
+  return [summarize_member(x) for x in members if hasattr(x, "signature")]
+
+def summarize_class(cls, compilation_unit=None):
+  """Reduces a parsed lexical.Class to a ClassRecord"""
+  if cls.body is not None:
+    (members, body) = (None, cls.body + (_text(cls.class_type),))
+  elif cls.members is None:
+    # Only indexed; members come from a full parse of the file
+    (members, body) = (None, None)
+  else:
+    (members, body) = (_summarize_members(cls.members), None)
+  return ClassRecord(_text(cls.name), _text(cls.namespace), cls.signature(),
+    _summarize_documentation(cls.documentation), members, compilation_unit,
+    body)
+
+# Parsers of the files whose members were parsed most recently, and the
+# members of every class in the files parsed in full, keyed on file name
+# and modification time. Documents render classes from a few files at a
+# time, and a parser lexes its whole file on first use.
+_member_parsers = OrderedDict()
+_file_members = OrderedDict()
+PARSERS_KEPT = 16
+
+def _recently_used(cache, key, make):
+  """Looks a key up in one of the caches above, making and keeping its value
+  if missing, and evicting the least recently used beyond PARSERS_KEPT"""
+  value = cache.pop(key, None)
+  if value is None:
+    value = make()
+    if len(cache) >= PARSERS_KEPT:
+      cache.popitem(last=False)
+  cache[key] = value
+  return value
+
+def _member_parser(filename):
+  """Returns (key, parser) for a source file as it is now"""
+  status = file_states.stat(filename)
+  key = (filename, status and modification_time(status))
+  def make():
+    with load_source(filename, status) as source:
+      return FileParser(source.text(), memoize=True)
+  return (key, _recently_used(_member_parsers, key, make))
+
+def _summarize_file(text):
+  """Member records for every class in a file, by (name, namespace)"""
+  members = {}
+  for cls in FileParser(text).parse_file().iter_classes():
+    members.setdefault((_text(cls.name), _text(cls.namespace)),
+                       _summarize_members(cls.members))
+  return members
+
+def _parse_members(record):
+  """Parses the members of a class whose body a lazy parse skipped, or
+  that was only indexed"""
+  (key, parser) = _member_parser(record.compilation_unit)
+  if record.body is not None:
+    (start, end, class_type) = record.body
+    namespace = ".".join(x for x in (record.namespace, record.name) if x)
+    members = parser.parse_members((start, end), class_type, namespace)
+    if members is not None:
+      return _summarize_members(members)
+  # Without a body, or if the file has changed since, find the class in a
+  # full parse of the file, shared by every class in it
+  members = _recently_used(_file_members, key,
+                           lambda: _summarize_file(parser.core.definition))
+  return list(members.get((record.name, record.namespace), []))
+
+def adopt_members(record, other):
+  """Takes the members another process parsed for the same class body,
+  if this record has yet to parse them"""
+  if (record._members is None and other._members is not None
+      and record.body is not None and record.body == other.body):
+    record._members = other._members
+
+def class_digest(record):
+  """A hash of everything autodoc renders for a class, so that documents
+  only need re-reading when it changes"""
+  sha = hashlib.sha1()
+  for item in [record] + record.members:
+    parts = [item.name, item.namespace, item.signature()]
+    if item.documentation is not None:
+      parts.extend(item.documentation.parts)
+    for part in parts:
+      sha.update(unicode(part).encode("utf-8"))
+      sha.update("\0")
+    sha.update("\1")
+  return sha.hexdigest()
@@ -0,0 +1,171 @@
+# coding: utf-8
+"""Loads C# source files for parsing.
+
+Each file is opened and read exactly once: small files in a single read,
+large ones mapped into memory. The encoding comes from any byte order mark
+at the start of that buffer, and the parser is handed the one string it
+decodes to. During a build, file_states keeps a snapshot of every source
+file's state, so that each is stat'ed at most once however many directives
+ask about it. File system calls are counted in source_stats, so that builds
+can report them; the counts are per process, so files loaded by parse
+workers or parallel readers are counted there."""
+
+import os
+import stat
+import mmap
+import codecs
+
+# Files at least this large are mapped rather than read
+MMAP_THRESHOLD = 1024 * 1024
+
+# Longest first, as the UTF-32 marks start with the UTF-16 ones
+_BYTE_ORDER_MARKS = (
+  (codecs.BOM_UTF32_LE, "utf-32-le"),
+  (codecs.BOM_UTF32_BE, "utf-32-be"),
+  (codecs.BOM_UTF8, "utf-8"),
+  (codecs.BOM_UTF16_LE, "utf-16-le"),
+  (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+class SourceStats(object):
+  """Counts of the stats and reads made for source files"""
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.stats = 0
+    self.scans = 0
+    self.reads = 0
+    self.mapped = 0
+    self.bytes = 0
+
+source_stats = SourceStats()
+
+def stat_source(filename):
+  """os.stat for a source file, or None if it isn't a regular file"""
+  source_stats.stats += 1
+  try:
+    status = os.stat(filename)
+  except OSError:
+    return None
+  if not stat.S_ISREG(status.st_mode):
+    return None
+  return status
+
+def modification_time(status):
+  return max(status.st_mtime, status.st_ctime)
+
+class FileStates(object):
+  """A snapshot of the state of source files, taken during a build.
+
+  Between start() and stop(), each file is stat'ed and each tree scanned at
+  most once, and every later question is answered from the snapshot.
+  Outside a build, every question goes to the file system."""
+  def __init__(self):
+    self.active = False
+    self._states = {}
+    self._trees = {}
+
+  def start(self):
+    """Begins a fresh snapshot"""
+    self._states.clear()
+    self._trees.clear()
+    self.active = True
+
+  def stop(self):
+    self._states.clear()
+    self._trees.clear()
+    self.active = False
+
+  def stat(self, filename):
+    """os.stat for a source file, or None if it isn't a regular file"""
+    if not self.active:
+      return stat_source(filename)
+    if filename not in self._states:
+      self._states[filename] = stat_source(filename)
+    return self._states[filename]
+
+  def scan(self, root, tree_filter):
+    """The source files a tree.TreeFilter picks out under a directory,
+    remembering their states"""
+    key = (root, tree_filter.key)
+    if key in self._trees:
+      return self._trees[key]
+    files = []
+    for (path, status) in tree_filter.walk(root):
+      files.append(path)
+      if self.active:
+        self._states[path] = status
+    if self.active:
+      self._trees[key] = files
+    return files
+
+file_states = FileStates()
+
+def detect_encoding(raw):
+  """Returns (encoding, length of byte order mark), or (None, 0) without one"""
+  start = raw[:4]
+  for (mark, encoding) in _BYTE_ORDER_MARKS:
+    if start.startswith(mark):
+      return (encoding, len(mark))
+  return (None, 0)
+
+class SourceFile(object):
+  """The raw contents of a source file, as a string or mmap, and the
+  modification time they were read at. Use as a context manager, so that
+  any mapping is released."""
+  def __init__(self, filename, raw, mtime):
+    self.filename = filename
+    self.raw = raw
+    self.mtime = mtime
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def close(self):
+    if isinstance(self.raw, mmap.mmap):
+      self.raw.close()
+
+  def text(self):
+    """Decodes the contents to unicode, without the byte order mark"""
+    (encoding, skip) = detect_encoding(self.raw)
+    if encoding is None:
+      print "Warning: Assuming utf-8 when no BOM on " + self.filename
+      encoding = "utf-8"
+    # Decoded straight from the buffer, rather than from a sliced copy
+    return codecs.getdecoder(encoding)(buffer(self.raw, skip))[0]
+
+def load_source(filename, status=None):
+  """Reads a source file with one open and one read or mapping. Without the
+  file's status from an earlier stat, it is taken with fstat."""
+  with open(filename, "rb") as f:
+    if status is None:
+      status = os.fstat(f.fileno())
+      source_stats.stats += 1
+    source_stats.reads += 1
+    source_stats.bytes += status.st_size
+    if status.st_size >= MMAP_THRESHOLD:
+      raw = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      source_stats.mapped += 1
+    else:
+      raw = f.read()
+  return SourceFile(filename, raw, modification_time(status))
+
+def reset_source_stats(app):
+  """Starts the counts afresh for each build"""
+  source_stats.reset()
+
+def stop_file_states(app, exception):
+  """Drops the build's snapshot, so that the next sees changes"""
+  file_states.stop()
+
+def log_source_stats(app, exception):
+  """Reports how many file system calls loading sources took, in verbose
+  builds"""
+  if source_stats.stats:
+    app.verbose("C# source files: {} stats, {} directory scans, {} reads "
+      "({} mapped), {} bytes".format(source_stats.stats, source_stats.scans,
+        source_stats.reads, source_stats.mapped, source_stats.bytes))
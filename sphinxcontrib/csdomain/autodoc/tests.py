@@ -2,13 +2,41 @@
 
 import unittest
 from .parser import FileParser, opensafe
-from .lexical import Comment, summarize_space
+from .lexical import Comment, summarize_space, TokenStream
+from . import lexical
 from .core import CoreParser
+from .directives import _parse_source_files, _remove_source_file, _find_classes
+from .directives import outdated_documents, merge_source_files
+from .directives import parse_declared_modules, _parse_module
+from .cache import ParseCache
+from . import source
+from .tree import TreeFilter, DEFAULT_INCLUDE, DEFAULT_EXCLUDE
+from .records import summarize_class, class_digest
+from . import records
+from .xmldoc import XmldocParser
+from xml.etree.ElementTree import ParseError
+from collections import defaultdict, OrderedDict
 import glob
 import os
+import pickle
+import shutil
+import tempfile
+import threading
 
 SAMPLE = "/Users/xgkkp/stylepack/app/Core/Utils/DBPreflight.cs"
 
+def _structure(value):
+  """Everything a parse result holds, as plain lists, tuples and dicts"""
+  if isinstance(value, list):
+    return [_structure(x) for x in value]
+  if isinstance(value, tuple):
+    return tuple(_structure(x) for x in value)
+  if isinstance(value, dict):
+    return dict((k, _structure(v)) for (k, v) in value.items())
+  if isinstance(value, lexical.NamedDefinition):
+    return (type(value).__name__, _structure(vars(value)))
+  return value
+
 class TestAutodoc(unittest.TestCase):
   def test_read(self):
     contents = opensafe(SAMPLE).read()
@@ -51,11 +79,92 @@ class TestAutodoc(unittest.TestCase):
     p = CoreParser("some text with a d) in the")
     self.assertEqual(p.skip_to_char(')'), "some text with a d")
 
+  def test_skip_word(self):
+    p = CoreParser("classy class")
+    self.assertFalse(p.skip_word("class"))
+    self.assertTrue(p.skip("class"))
+    self.assertEqual(p.cur_line(), "y class")
+    self.assertFalse(p.skip("{"))
+
+  def test_line_lookup(self):
+    p = CoreParser("first\r\nsecond\nthird")
+    p.pos = p.definition.index("cond")
+    self.assertEqual(p.line_no, 2)
+    self.assertEqual(p.col_no, 2)
+    self.assertEqual(p.get_line(), "second")
+    self.assertEqual(p.current_line_start_pos(), p.definition.index("second"))
+    self.assertEqual(p.get_line(3), "third")
+
+  def test_token_stream(self):
+    source = '// comment\n#region x\npublic @class Foo { string s = @"a""b"; char c = \'\\n\'; }'
+    stream = TokenStream(source)
+    self.assertEqual(list(stream.texts), ['public', '@class', 'Foo', '{', 'string', 's', '=',
+      'a""b', ';', 'char', 'c', '=', '\\n', ';', '}'])
+    self.assertEqual(stream.kinds[0], lexical.TOKEN_KEYWORD)
+    self.assertEqual(stream.kinds[1], lexical.TOKEN_IDENTIFIER)
+    self.assertEqual(len(stream.comments), 1)
+    self.assertEqual(len(stream.directives), 1)
+    self.assertEqual(stream.index_at(0), 0)
+
+  def test_swallow_through_comment(self):
+    p = FileParser("/* a comment */ { }")
+    p.swallow_with_ws("{")
+    self.assertEqual(p.cur_line(), "}")
+
+  def test_memoized_type(self):
+    p = FileParser("List<int> Items { get; }", memoize=True)
+    state = p.core.savepos()
+    first = p._parse_type()
+    after = p.core.savepos()
+    p.core.restorepos(state)
+    self.assertIs(p._parse_type(), first)
+    self.assertEqual(p.core.savepos(), after)
+    self.assertEqual(p.memo_hits, 1)
+
+  def test_memoized_results_never_mutated(self):
+    text = """namespace Space {
+  /// <summary>A widget</summary>
+  [Serializable, Category("Things")]
+  public sealed class Widget<T> : Base<T>, IThing where T : class {
+    [NonSerialized] private static readonly List<int[]> items;
+    public event EventHandler<Args> Changed;
+    [Obsolete] protected internal virtual Dictionary<string, T> Map { get; set; }
+    public override IList<T>[] Find<U>(ref T item, params object[] rest) { }
+    public static explicit operator int(Widget<T> w) { return 0; }
+    public T this[int index] { get { return default(T); } }
+    public delegate void Handler(object sender);
+  }
+}"""
+    p = FileParser(text, memoize=True)
+    p.parse_file()
+    self.assertTrue(p.memo_hits)
+    # Every result kept is still what parsing afresh at its position gives
+    for (key, (result, error, state)) in p._memo.items():
+      if error is None:
+        fresh = FileParser(text)
+        fresh.core.restorepos((key[1], None))
+        self.assertEqual(_structure(getattr(fresh, key[0])(*key[2:])),
+                         _structure(result))
+
+  def test_skip_body(self):
+    body = r"""{ var s = "}\"}"; var v = @"}""}"; char c = '}'; /* } */ // }
+      if (s == null) { return; } }"""
+    p = FileParser("void Method() " + body + " int Next;")
+    m = p._parse_method_declaration()
+    self.assertEqual(m.body.form, body)
+    self.assertEqual(p.cur_line(), "int Next;")
+
   def test_new_expr(self):
     p = FileParser("var x = new []{}()something(withpar);")
     p._parse_balanced_expression()
     self.assertEqual(p.core.next_char, ';')
 
+  def test_expression_source(self):
+    p = FileParser('new[] { "};", \'}\', (a[0]) /* ; */ } ; rest')
+    expr = p._parse_balanced_expression()
+    self.assertEqual(str(expr), 'new[] { "};", \'}\', (a[0]) /* ; */ } ')
+    self.assertEqual(p.core.next_char, ';')
+
   def test_parsing_xmldoc(self):
     # doc = ["/ <summary>", "/ Contains methods to probe various details about a database, without attempting", "/ to connect proper, i.e. avoiding NHibernate.", "/ </summary>"]
     doc = ['/ <summary>', '/ Initialise with only a hostname and port', '/ </summary>', '/ <param name="hostname">The hostname to connect to</param>', '/ <param name="port">The port to connect to</param>', '/ <remarks>This method can be useful when checking for server existence</remarks><returns>Some value</returns>']
@@ -235,3 +344,420 @@ class TestAutodoc(unittest.TestCase):
     p = FileParser('public static IQueryable<T> Where<T>(this IQueryable<T> source, string predicate, params object[] values)')
     p._parse_method_header()
 
+
+class _Config(object):
+  cs_autodoc_parse_processes = 1
+  cs_autodoc_cache_dir = None
+  cs_autodoc_include = DEFAULT_INCLUDE
+  cs_autodoc_exclude = DEFAULT_EXCLUDE
+  cs_autodoc_projects = False
+  cs_autodoc_lazy_members = False
+  cs_autodoc_quick_index = False
+  source_encoding = 'utf-8-sig'
+
+class _Environment(object):
+  """Just the parts of a BuildEnvironment that source tracking uses"""
+  def __init__(self, domaindata, srcdir=None):
+    self.domaindata = {'cs': domaindata}
+    self.config = _Config()
+    self.srcdir = srcdir
+
+  def doc2path(self, docname):
+    return os.path.join(self.srcdir, docname + ".rst")
+
+  def relfn2path(self, filename, docname=None):
+    return (filename, os.path.join(self.srcdir, filename))
+
+class TestParseSourceFiles(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.filenames = []
+    for name in ("B", "A", "C"):
+      filename = os.path.join(self.tempdir, name + ".cs")
+      with open(filename, "w") as f:
+        f.write("namespace Space {{ class {0} {{ }} class {0}Two {{ }} }}".format(name))
+      self.filenames.append(filename)
+
+  def tearDown(self):
+    source.file_states.stop()
+    shutil.rmtree(self.tempdir)
+
+  def _domaindata(self):
+    return {'namespaces': defaultdict(OrderedDict), 'classes': {},
+            'modules': {}, 'files': {}, 'class_suffixes': {},
+            'module_docs': {}, 'rendered': {}, 'indexed': set()}
+
+  def _rewrite(self, filename, contents):
+    with open(filename, "w") as f:
+      f.write(contents)
+    # Make sure the change is visible through the modification time
+    later = os.stat(filename).st_mtime + 10
+    os.utime(filename, (later, later))
+
+  def test_parallel_matches_serial(self):
+    serial = self._domaindata()
+    _parse_source_files(self.filenames, serial, 1)
+    parallel = self._domaindata()
+    _parse_source_files(self.filenames, parallel, 2)
+    names = lambda data: [x.name for x in data['namespaces']['Space'].values()]
+    self.assertEqual(names(serial), ["A", "ATwo", "B", "BTwo", "C", "CTwo"])
+    self.assertEqual(names(parallel), names(serial))
+    self.assertEqual(sorted(parallel['classes']), sorted(serial['classes']))
+    self.assertEqual(parallel['modules'], serial['modules'])
+
+  def test_find_classes(self):
+    data = self._domaindata()
+    _parse_source_files(self.filenames, data)
+    self.assertEqual(_find_classes("A", data), ["Space.A"])
+    self.assertEqual(_find_classes("Space.BTwo", data), ["Space.BTwo"])
+    self.assertEqual(_find_classes("Two", data), ["Space.ATwo", "Space.BTwo", "Space.CTwo"])
+    _remove_source_file(self.filenames[0], data)
+    self.assertEqual(_find_classes("BTwo", data), [])
+    self.assertNotIn("BTwo", data['class_suffixes'])
+    self.assertNotIn(self.filenames[0], data['files'])
+    self.assertEqual(list(data['namespaces']['Space']),
+      ["Space.A", "Space.ATwo", "Space.C", "Space.CTwo"])
+
+  def test_outdated_documents(self):
+    data = self._domaindata()
+    env = _Environment(data)
+    filename = self.filenames[1]
+    self._rewrite(filename, "namespace Space { /// <summary>A</summary>\n"
+                            "class A { void F() { int x; } } }")
+    _parse_source_files(self.filenames, data)
+    data['module_docs']['index'] = [(self.tempdir, True)]
+    data['rendered']['a'] = {'A': class_digest(data['classes']['Space.A'])}
+    data['rendered']['b'] = {'B': class_digest(data['classes']['Space.B'])}
+    data['rendered']['d'] = {'D': None}
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), [])
+    # Changing a method body alone affects nothing that is rendered
+    self._rewrite(filename, "namespace Space { /// <summary>A</summary>\n"
+                            "class A { void F() { int y; } } }")
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), [])
+    self._rewrite(filename, "namespace Space { /// <summary>Changed</summary>\n"
+                            "class A { void F() { int y; } } }")
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), ['a'])
+    # ...as re-reading it would
+    data['rendered']['a'] = {'A': class_digest(data['classes']['Space.A'])}
+    # New files in a declared module are picked up
+    self._rewrite(os.path.join(self.tempdir, "D.cs"), "class D { }")
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), ['d'])
+
+  def test_class_found_after_first_read(self):
+    data = self._domaindata()
+    env = _Environment(data)
+    _parse_source_files(self.filenames[:1], data)
+    data['module_docs']['index'] = [(self.filenames[0], False)]
+    # a asks for A before z, read after it, declares the module with A
+    data['rendered']['a'] = {'A': None}
+    _parse_source_files(self.filenames[1:2], data)
+    data['module_docs']['z'] = [(self.filenames[1], False)]
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), ['a'])
+    data['rendered']['a'] = {'A': class_digest(data['classes']['Space.A'])}
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), [])
+
+  def test_parallel_readers_find_declared_classes(self):
+    lib = os.path.join(self.tempdir, "lib")
+    os.mkdir(lib)
+    self._rewrite(os.path.join(lib, "Helper.cs"),
+                  "namespace Space { class Helper { } }")
+    self._rewrite(os.path.join(self.tempdir, "a.rst"),
+                  "A\n=\n\n.. cs:autodoc:: Helper\n")
+    self._rewrite(os.path.join(self.tempdir, "z.rst"),
+                  "Z\n=\n\n.. cs:autodocmodule:: lib\n   :tree:\n")
+    env = _Environment(self._domaindata(), self.tempdir)
+    parse_declared_modules(None, env, ["a", "z"])
+    # As with sphinx-build -j, each document is read from its own copy
+    copy = lambda: _Environment(pickle.loads(pickle.dumps(
+      env.domaindata['cs'], pickle.HIGHEST_PROTOCOL)), self.tempdir)
+    (a, z) = (copy(), copy())
+    _parse_module(z, [os.path.join(lib, "Helper.cs")], True)
+    z.domaindata['cs']['module_docs']['z'] = [(lib, True)]
+    found = _find_classes("Helper", a.domaindata['cs'])
+    self.assertEqual(found, ["Space.Helper"])
+    a.domaindata['cs']['rendered']['a'] = {
+      'Helper': class_digest(a.domaindata['cs']['classes'][found[0]])}
+    data = env.domaindata['cs']
+    for (docname, reader) in (("a", a), ("z", z)):
+      merge_source_files(None, env, [docname], reader)
+      for key in ('module_docs', 'rendered'):
+        data[key].update(reader.domaindata['cs'][key])
+    self.assertEqual(outdated_documents(None, env, set(), set(), set()), [])
+
+  def test_lazy_members(self):
+    self._rewrite(self.filenames[1], "namespace Space {\n"
+      "class A { /// <summary>F</summary>\n void F() { }\n"
+      "  class Inner { int x; } }\n"
+      "/// <summary>Two</summary>\n"
+      "class ATwo { int G() { return 1; } /** Not doc */ } }")
+    eager = self._domaindata()
+    _parse_source_files(self.filenames, eager)
+    lazy = self._domaindata()
+    _parse_source_files(self.filenames, lazy, lazy=True)
+    classes = lazy['classes']
+    # Bodies declaring nested types are parsed up front, to find them
+    self.assertIsNone(classes['Space.A'].body)
+    self.assertIsNotNone(classes['Space.A.Inner'].body)
+    summary = lambda record: [(x.namespace, x.signature(), x.documentation
+      and x.documentation.parts) for x in record.members]
+    for (name, record) in eager['classes'].iteritems():
+      self.assertEqual(summary(classes[name]), summary(record))
+      self.assertEqual(class_digest(classes[name]), class_digest(record))
+
+  def test_quick_index(self):
+    self._rewrite(self.filenames[1], "using System;\n"
+      "namespace Space.Inner {\n"
+      "/// <summary>A</summary>\n"
+      "[Serializable] public partial class A<T> : Base where T : class {\n"
+      "  string s = \"class Not {\";\n"
+      "  T F<U>() where U : struct { return '}' == 0 ? null : null; }\n"
+      "  int P { get; set; }\n"
+      "  int[] a = new int[] { 1 }, b = { 2 };\n"
+      "  // <summary>Not documentation</summary>\n"
+      "  struct Nested { void G() { } }\n"
+      "  delegate void D(int x);\n"
+      "  enum E { X = 1, Y }\n"
+      "} }\n")
+    full = self._domaindata()
+    _parse_source_files(self.filenames, full)
+    indexed = self._domaindata()
+    _parse_source_files(self.filenames, indexed, indexable=self.filenames)
+    self.assertEqual(indexed['indexed'], set(self.filenames))
+    self.assertEqual(sorted(indexed['classes']), sorted(full['classes']))
+    self.assertIn("Space.Inner.A.Nested", indexed['classes'])
+    for (name, record) in full['classes'].iteritems():
+      quick = indexed['classes'][name]
+      self.assertIsNone(quick._members)
+      self.assertEqual(quick.signature(), record.signature())
+      self.assertEqual(class_digest(quick), class_digest(record))
+    # Asking for a full parse replaces the index, and it is never undone
+    self.assertTrue(_parse_source_files([self.filenames[1]], indexed))
+    self.assertNotIn(self.filenames[1], indexed['indexed'])
+    self.assertIsNotNone(indexed['classes']['Space.Inner.A']._members)
+    self.assertFalse(_parse_source_files(self.filenames, indexed,
+                                         indexable=self.filenames))
+
+  def test_quick_index_trees_only(self):
+    data = self._domaindata()
+    env = _Environment(data)
+    env.config.cs_autodoc_quick_index = True
+    _parse_source_files(self.filenames, data)
+    os.mkdir(os.path.join(self.tempdir, "tree"))
+    data['module_docs']['index'] = [
+      (os.path.join(self.tempdir, "*.cs"), False),
+      (os.path.join(self.tempdir, "tree"), True)]
+    for name in ("D.cs", "tree/E.cs"):
+      self._rewrite(os.path.join(self.tempdir, name),
+                    "namespace Space { class X { int f; } class Y { } }")
+    outdated_documents(None, env, set(), set(), set())
+    self.assertEqual(data['indexed'],
+                     set([os.path.join(self.tempdir, "tree/E.cs")]))
+    # Every class of an indexed file finds its members in one full parse
+    records._file_members.clear()
+    tree = os.path.join(self.tempdir, "tree")
+    for name in data['files'][os.path.join(tree, "E.cs")]:
+      class_digest(data['classes'][name])
+    self.assertEqual(len(records._file_members), 1)
+    self.assertEqual(len(data['classes']['Space.X'].members), 1)
+
+  def test_cache_reuses_records(self):
+    cache = ParseCache(os.path.join(self.tempdir, "cache"))
+    first = self._domaindata()
+    _parse_source_files(self.filenames, first, cache=cache)
+    self.assertEqual(len(os.listdir(cache.directory)), 3)
+    second = self._domaindata()
+    _parse_source_files(self.filenames, second, cache=cache)
+    self.assertEqual(sorted(second['classes']), sorted(first['classes']))
+    # Records come from the cache entry, not from parsing the file again
+    with open(self.filenames[0], "rb") as f:
+      cache.put(cache.key(f.read()), [])
+    third = self._domaindata()
+    _parse_source_files(self.filenames, third, cache=cache)
+    self.assertEqual(sorted(third['classes']),
+      ["Space.A", "Space.ATwo", "Space.C", "Space.CTwo"])
+
+class TestParseCache(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_prune_oldest(self):
+    cache = ParseCache(self.tempdir)
+    for (age, name) in enumerate(["c", "b", "a"]):
+      cache.put(name, "x" * 1000)
+      when = 1000000 - age * 100
+      os.utime(os.path.join(self.tempdir, name + ".pickle"), (when, when))
+    self.assertEqual(cache.get("missing"), None)
+    self.assertEqual(cache.prune(2500), 1)
+    self.assertEqual(cache.get("a"), None)
+    self.assertEqual(cache.get("c"), "x" * 1000)
+    self.assertEqual(cache.clear(), 2)
+
+  def test_failed_put(self):
+    cache = ParseCache(self.tempdir)
+    nested = []
+    for _ in range(100000):
+      nested = [nested]
+    for value in (nested, threading.Lock()):
+      cache.put("failed", value)
+    self.assertEqual(os.listdir(self.tempdir), [])
+
+class TestSource(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    source.source_stats.reset()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _write(self, name, data):
+    filename = os.path.join(self.tempdir, name)
+    with open(filename, "wb") as f:
+      f.write(data)
+    return filename
+
+  def test_byte_order_marks(self):
+    text = u"class Caf\xe9 { }"
+    for (bom, encoding) in [("\xef\xbb\xbf", "utf-8"), ("\xff\xfe", "utf-16-le"),
+                            ("\xfe\xff", "utf-16-be")]:
+      filename = self._write("A.cs", bom + text.encode(encoding))
+      with source.load_source(filename) as loaded:
+        self.assertEqual(loaded.text(), text)
+    self.assertEqual(opensafe(filename).read(), text)
+    self.assertEqual(opensafe(filename, 'r').read(), text)
+
+  def test_single_read(self):
+    filename = self._write("A.cs", "class A { }\n")
+    threshold = source.MMAP_THRESHOLD
+    try:
+      source.MMAP_THRESHOLD = 8
+      with source.load_source(filename) as loaded:
+        cache = ParseCache(self.tempdir)
+        self.assertEqual(cache.key(loaded.raw), cache.key("class A { }\n"))
+        self.assertEqual(loaded.text(), u"class A { }\n")
+    finally:
+      source.MMAP_THRESHOLD = threshold
+    stats = source.source_stats
+    self.assertEqual((stats.stats, stats.reads, stats.mapped, stats.bytes),
+                     (1, 1, 1, 12))
+
+  def test_file_states_snapshot(self):
+    os.mkdir(os.path.join(self.tempdir, "Sub"))
+    first = self._write("A.cs", "class A { }")
+    second = self._write(os.path.join("Sub", "B.cs"), "class B { }")
+    self._write("Notes.txt", "")
+    states = source.FileStates()
+    states.start()
+    try:
+      self.assertEqual(sorted(states.scan(self.tempdir, TreeFilter())),
+                       [first, second])
+      stats = source.source_stats.stats
+      os.remove(first)
+      # Answered from the snapshot, without touching the file system
+      self.assertIsNotNone(states.stat(first))
+      self.assertEqual(states.scan(self.tempdir, TreeFilter()), [first, second])
+      self.assertEqual(source.source_stats.stats, stats)
+    finally:
+      states.stop()
+    self.assertIsNone(states.stat(first))
+    self.assertEqual(states.scan(self.tempdir, TreeFilter()), [second])
+
+  def _tree(self, tree_filter):
+    return sorted(os.path.relpath(path, self.tempdir).replace(os.sep, "/")
+                  for (path, _) in tree_filter.walk(self.tempdir))
+
+  def test_tree_filter(self):
+    for directory in ("Lib", "Lib/bin", "Lib/Forms", "App"):
+      os.mkdir(os.path.join(self.tempdir, directory))
+    for name in ("Lib/A.cs", "Lib/bin/B.cs", "Lib/A.g.cs", "Lib/Forms/F.cs",
+                 "Lib/Forms/F.Designer.cs", "App/Main.cs", "App/Old.cs"):
+      self._write(name, "class X { }")
+    self.assertEqual(self._tree(TreeFilter()),
+      ["App/Main.cs", "App/Old.cs", "Lib/A.cs", "Lib/Forms/F.cs"])
+    self.assertEqual(self._tree(TreeFilter(exclude=["Lib/Forms"])),
+      ["App/Main.cs", "App/Old.cs", "Lib/A.cs", "Lib/A.g.cs", "Lib/bin/B.cs"])
+    # Only what a project compiles, where a directory has one
+    self._write("App/App.csproj", '<Project xmlns="http://schemas.microsoft.com'
+      '/developer/msbuild/2003"><ItemGroup><Compile Include="Main.cs" />'
+      '</ItemGroup></Project>')
+    self._write("Lib/Lib.csproj", '<Project Sdk="Microsoft.NET.Sdk"><ItemGroup>'
+      '<Compile Remove="Forms\\**" /></ItemGroup></Project>')
+    self.assertEqual(self._tree(TreeFilter(projects=True)),
+      ["App/Main.cs", "Lib/A.cs"])
+    # SDK projects' Include items add to the default, unless it is turned off
+    self._write("Lib/Lib.csproj", '<Project Sdk="Microsoft.NET.Sdk"><ItemGroup>'
+      '<Compile Include="..\\Shared\\Linked.cs" /></ItemGroup></Project>')
+    self.assertEqual(self._tree(TreeFilter(projects=True)),
+      ["App/Main.cs", "Lib/A.cs", "Lib/Forms/F.cs"])
+    self._write("Lib/Lib.csproj", '<Project Sdk="Microsoft.NET.Sdk">'
+      '<PropertyGroup><EnableDefaultCompileItems>false'
+      '</EnableDefaultCompileItems></PropertyGroup><ItemGroup>'
+      '<Compile Include="A.cs" /></ItemGroup></Project>')
+    self.assertEqual(self._tree(TreeFilter(projects=True)),
+      ["App/Main.cs", "Lib/A.cs"])
+
+  def test_parser_keeps_offsets(self):
+    core = CoreParser(u"\n\n  class A { }  \n")
+    self.assertEqual((core.pos, core.end), (4, 15))
+    self.assertEqual(core.line_no, 3)
+    self.assertTrue(core.skip_word("class"))
+    core.pos = core.end
+    self.assertFalse(core.skip_ws())
+
+class TestRecords(unittest.TestCase):
+  def test_summarize_class(self):
+    cu = FileParser("""namespace Space {
+      /// <summary>A class</summary>
+      public class Thing : Base {
+        /// <summary>Does it</summary>
+        public void Do(int x) { x++; }
+        int field;
+      } }""").parse_file()
+    (record,) = [summarize_class(x, "Thing.cs") for x in cu.iter_classes()]
+    record = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(record.signature(), "public class Thing : Base")
+    self.assertEqual((record.name, record.namespace), ("Thing", "Space"))
+    self.assertEqual(record.compilation_unit, "Thing.cs")
+    self.assertEqual(record.documentation.parse_documentation(), "A class.")
+    method = record.members[0]
+    self.assertEqual(method.signature(), "public void Do(int x)")
+    self.assertEqual(method.namespace, "Space.Thing")
+    self.assertEqual(len(record.members), 2)
+
+class TestXmldoc(unittest.TestCase):
+  def _convert(self, text):
+    return XmldocParser(text).parse_lines()
+
+  def test_sentences_and_fields(self):
+    lines = self._convert('<summary>\nDoes a thing\n</summary>\n'
+      '<param name="a">The <c>first</c>value</param>\n'
+      '<remarks>Really</remarks><returns>Some\nvalue</returns>')
+    self.assertEqual(lines, ["Does a thing. Really.", "",
+                             ":param a: The ``first``\\ value",
+                             ":returns: Some", "   value"])
+
+  def test_references(self):
+    lines = self._convert('<summary>Uses <see cref="T:A.List{T}"/> and '
+      '<paramref name="x"/>, or <see langword="null"/></summary>'
+      '<typeparam name="T">Item</typeparam>'
+      '<exception cref="T:System.Exception">Always</exception>'
+      '<seealso cref="M:A.Run"/>')
+    self.assertEqual(lines, [
+      "Uses :cs:class:`A.List\\<T>` and *x*, or ``null``.", "",
+      ":typeparam T: Item", ":throws System.Exception: Always", "",
+      ".. seealso:: :cs:method:`A.Run`"])
+
+  def test_blocks(self):
+    lines = self._convert('<summary>One<para>Two</para>'
+      '<code>\n    a();\n      b();\n</code></summary>')
+    self.assertEqual(lines, ["One", "", "Two", "", ".. code-block:: csharp",
+                             "", "   a();", "     b();"])
+
+  def test_malformed_writes_nothing(self):
+    out = ["existing"]
+    with self.assertRaises(ParseError):
+      XmldocParser("<summary>Unclosed").parse_lines(out)
+    self.assertEqual(out, ["existing"])
+
@@ -0,0 +1,158 @@
+# coding: utf-8
+"""Finds the source files under a cs:autodocmodule :tree: root.
+
+Entries are matched against include and exclude globs as the tree is
+walked, so excluded directories such as bin/ and obj/ are never descended
+into, and only included files are stat'ed. A glob matches either an
+entry's name or its path relative to the root, written with forward
+slashes. Optionally, a directory holding a .csproj that lists its
+<Compile> items contributes only the files that project compiles."""
+
+import os
+import re
+import stat
+import fnmatch
+from xml.etree import ElementTree
+from .source import stat_source, source_stats
+
+try:
+  from os import scandir
+except ImportError:
+  try:
+    from scandir import scandir
+  except ImportError:
+    scandir = None
+
+DEFAULT_INCLUDE = ("*.cs",)
+# Build output, restored packages, tooling state and generated code
+DEFAULT_EXCLUDE = ("bin", "obj", "packages", "node_modules", ".git", ".vs",
+                   "*.g.cs", "*.g.i.cs", "*.Designer.cs")
+
+# Whether the file system ignores case, as on Windows
+_IGNORE_CASE = os.path.normcase("A") == "a"
+
+def _globs_re(globs):
+  """One pattern matching any of a list of globs"""
+  if not globs:
+    return None
+  return re.compile("|".join(fnmatch.translate(x) for x in globs),
+                    re.IGNORECASE if _IGNORE_CASE else 0)
+
+class _Entry(object):
+  """The parts of a scandir DirEntry used here, for Pythons without it"""
+  def __init__(self, directory, name):
+    self.name = name
+    self.path = os.path.join(directory, name)
+
+  def is_dir(self, follow_symlinks=True):
+    source_stats.stats += 1
+    try:
+      status = os.stat(self.path) if follow_symlinks else os.lstat(self.path)
+    except OSError:
+      return False
+    return stat.S_ISDIR(status.st_mode)
+
+def _list_directory(directory):
+  source_stats.scans += 1
+  if scandir is not None:
+    return list(scandir(directory))
+  return [_Entry(directory, name) for name in os.listdir(directory)]
+
+class _Project(object):
+  """The files a .csproj compiles, relative to its directory"""
+  def __init__(self, includes, removes):
+    self._include = _globs_re(includes)
+    self._remove = _globs_re(removes)
+
+  def compiles(self, relative):
+    if self._include is None or not self._include.match(relative):
+      return False
+    return not (self._remove is not None and self._remove.match(relative))
+
+def _project_glob(item):
+  item = item.strip().replace("\\", "/")
+  if item.startswith("./"):
+    item = item[2:]
+  # ** also matches no directories at all, as in MSBuild
+  return item.replace("**/", "*")
+
+def _tag(element):
+  return element.tag.rsplit("}", 1)[-1]
+
+def _compiles_by_default(root):
+  """Whether a project compiles **/*.cs without listing it: SDK-style
+  projects do, unless they turn default items off"""
+  if not (root.get("Sdk") or any(_tag(x) == "Sdk" for x in root)):
+    return False
+  return not any(_tag(x) in ("EnableDefaultItems", "EnableDefaultCompileItems")
+                 and (x.text or "").strip().lower() == "false"
+                 for x in root.iter())
+
+def read_project(filename):
+  """The Compile items of a .csproj, or None if it can't be read"""
+  try:
+    root = ElementTree.parse(filename).getroot()
+  except (IOError, ElementTree.ParseError) as ex:
+    print "Warning: Could not read C# project {}: {}".format(filename, ex)
+    return None
+  items = {"Include": [], "Remove": []}
+  # Include items add to the default, rather than replacing it
+  if _compiles_by_default(root):
+    items["Include"].append(_project_glob("**/*.cs"))
+  for element in root.iter():
+    if _tag(element) != "Compile":
+      continue
+    for (attribute, globs) in items.iteritems():
+      for item in element.get(attribute, "").split(";"):
+        # Properties can't be evaluated here
+        if item.strip() and "$(" not in item:
+          globs.append(_project_glob(item))
+  return _Project(items["Include"], items["Remove"])
+
+class TreeFilter(object):
+  """Which files under a tree root are source files"""
+  def __init__(self, include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE,
+               projects=False):
+    # Identifies the filter, for remembering what it found
+    self.key = (tuple(include), tuple(exclude), bool(projects))
+    self._include = _globs_re(include)
+    self._exclude = _globs_re(exclude)
+    self.projects = projects
+
+  def _matches(self, regex, name, relative):
+    return regex is not None and (regex.match(name) or regex.match(relative))
+
+  def walk(self, root):
+    """Yields (path, status) for every source file under root. As with
+    os.walk, links to directories are not followed."""
+    # Directories to visit, with their paths relative to the root and to
+    # the directory of the projects, if any, that they belong to
+    pending = [(root, "", None, "")]
+    while pending:
+      (directory, relative, project, in_project) = pending.pop()
+      try:
+        entries = _list_directory(directory)
+      except OSError:
+        continue
+      if self.projects:
+        found = [read_project(x.path) for x in entries
+                 if x.name.endswith(".csproj")]
+        if found:
+          # Files any of the projects here compile, unless one is unreadable
+          project = None if None in found else found
+          in_project = ""
+      for entry in entries:
+        name = entry.name
+        path = relative + name
+        if self._matches(self._exclude, name, path):
+          continue
+        if self._matches(self._include, name, path):
+          status = stat_source(entry.path)
+          if status is not None:
+            if project is None or any(x.compiles(in_project + name)
+                                      for x in project):
+              yield (entry.path, status)
+            continue
+        if entry.is_dir(follow_symlinks=False):
+          pending.append((entry.path, path + "/", project,
+                          in_project + name + "/"))
@@ -1,69 +1,206 @@
 # coding: utf-8
-
-import xml.etree.ElementTree as ET
+"""Converts XML documentation comments to reStructuredText.
+
+The comment is converted as expat streams through it, without building an
+element tree. Text runs on into paragraphs, with <summary>, <remarks> and
+<value> each ending in a full stop, whilst <para> and <code> start blocks of
+their own. Parameter, return value, type parameter and exception
+descriptions are floated to a field list at the end, followed by any
+<seealso> references."""
+
+import textwrap
+from xml.parsers import expat
+from xml.etree.ElementTree import ParseError
+
+# Sections whose text runs on into the surrounding paragraph
+_SENTENCE_TAGS = ("summary", "remarks", "value")
+# Inline markup, converted once the element's text is known
+_INLINE_TAGS = ("c", "see", "paramref", "typeparamref")
+# Descriptions floated into the field list at the end
+_FIELD_TAGS = ("param", "returns", "typeparam", "exception")
+
+# Roles for the kinds of member named by a cref's prefix, as in "T:Name"
+_CREF_ROLES = {"T": "class", "M": "method", "P": "property", "N": "namespace"}
+
+def _cref_name(cref):
+  if len(cref) > 2 and cref[1] == ":":
+    cref = cref[2:]
+  # Generic arguments are written {T} in crefs
+  return cref.replace("{", "<").replace("}", ">")
+
+def _cref_reference(cref):
+  """A cross-reference to the member named by a cref attribute"""
+  role = "member"
+  if len(cref) > 2 and cref[1] == ":":
+    role = _CREF_ROLES.get(cref[0], "member")
+  # Escaped, so that a generic argument isn't taken as an explicit target
+  return u":cs:{}:`{}`".format(role, _cref_name(cref).replace("<", "\\<"))
 
 class XmldocParser(object):
   def __init__(self, doctext):
     self.fulltext = doctext
 
   def parse(self):
-
-    # Flatten any remark / summary,
-
-    # c is inline code
-    # code is code blocks
-
-    # Argument-list nodes:
-    # param, returns, typeparam, exception
-
-    # Seealso specially handled
-
-    # Special wrap
-    spec = "<xmldoc>{}</xmldoc>".format(self.fulltext)
-    root = ET.fromstring(spec)
-    return self.process_node(root)
-
-  def flatten_node(self, node):
-    # print "Flattening " + node.tag
-    parts = []
-    arg_lists = []
-
-    if node.text:
-      parts.append(node.text.strip())
-    for child in node:
-      # If it's a parameter list node, skip for now
-      if child.tag in ("param", "returns", "typeparam", "exception"):
-        # Float these to the end
-        arg_lists.append(child)
+    return "\n".join(self.parse_lines())
+
+  def parse_lines(self, out=None):
+    """Appends the converted lines to out, or a new list, and returns it.
+    Raises ParseError for malformed XML, having written nothing."""
+    converter = _Converter()
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = converter.start
+    parser.EndElementHandler = converter.end
+    parser.CharacterDataHandler = converter.data
+    text = u"<xmldoc>" + self.fulltext + u"</xmldoc>"
+    try:
+      parser.Parse(text.encode("utf-8"), True)
+    except expat.ExpatError as ex:
+      raise ParseError(str(ex))
+    if out is None:
+      out = []
+    out.extend(converter.close())
+    return out
+
+class _Converter(object):
+  """Expat handlers writing reStructuredText as elements open and close"""
+  def __init__(self):
+    self.lines = []
+    self.fields = []
+    self.references = []
+    # Stripped runs of text making up the current paragraph
+    self.paragraph = []
+    # Raw text since the last element boundary
+    self.segment = []
+    self.after_inline = False
+    # For each open element, (tag, attributes, state saved at the start)
+    self.stack = []
+
+  def _break_segment(self):
+    text = "".join(self.segment).strip()
+    if text:
+      self.paragraph.append(text)
+    self.segment = []
+    self.after_inline = False
+
+  def _break_paragraph(self):
+    self._break_segment()
+    if self.paragraph:
+      self.lines.extend(" ".join(self.paragraph).split("\n"))
+      self.lines.append("")
+      self.paragraph = []
+
+  def _inline(self, markup):
+    # Inline markup must not directly follow or precede a word character;
+    # an escaped space separates them without showing up
+    if self.segment and self.segment[-1][-1:].isalnum():
+      markup = "\\ " + markup
+    self.segment.append(markup)
+    self.after_inline = True
+
+  def data(self, text):
+    if self.after_inline and text[:1].isalnum():
+      text = "\\ " + text
+    self.after_inline = False
+    self.segment.append(text)
+
+  def start(self, tag, attributes):
+    saved = None
+    if tag in _INLINE_TAGS or tag == "seealso":
+      saved = self.segment
+      self.segment = []
+      self.after_inline = False
+    elif tag in _FIELD_TAGS:
+      self._break_segment()
+      saved = (self.lines, self.paragraph)
+      self.lines = []
+      self.paragraph = []
+    elif tag in ("para", "code"):
+      self._break_paragraph()
+    else:
+      self._break_segment()
+      saved = (self.paragraph, len(self.paragraph))
+    self.stack.append((tag, attributes, saved))
+
+  def end(self, tag):
+    (tag, attributes, saved) = self.stack.pop()
+    if tag in _INLINE_TAGS or tag == "seealso":
+      text = "".join(self.segment).strip()
+      self.segment = saved
+      self._end_inline(tag, attributes, text)
+    elif tag in _FIELD_TAGS:
+      self._break_paragraph()
+      body = self.lines
+      while body and not body[-1].strip():
+        body.pop()
+      (self.lines, self.paragraph) = saved
+      self._end_field(tag, attributes, body)
+    elif tag == "code":
+      code = textwrap.dedent("".join(self.segment).strip("\n")).rstrip()
+      self.segment = []
+      self.lines.extend([u".. code-block:: csharp", u""])
+      self.lines.extend((u"   " + line).rstrip() for line in code.split("\n"))
+      self.lines.append("")
+    elif tag == "para":
+      self._break_paragraph()
+    else:
+      self._break_segment()
+      if tag in _SENTENCE_TAGS:
+        (paragraph, length) = saved
+        # Finish the section's text with a full stop, if it added any
+        added = self.paragraph is not paragraph or len(paragraph) > length
+        if added and self.paragraph and not self.paragraph[-1].endswith("."):
+          self.paragraph[-1] += "."
+
+  def _end_inline(self, tag, attributes, text):
+    if tag == "c":
+      if text:
+        self._inline(u"``{}``".format(text))
+    elif tag in ("paramref", "typeparamref"):
+      self._inline(u"*{}*".format(attributes.get("name", "")))
+    elif "cref" in attributes:
+      if tag == "seealso":
+        self.references.append(_cref_reference(attributes["cref"]))
       else:
-        parts.append(self.process_node(child))
-      if child.tail:
-        tail = child.tail.strip()
-        if tail:
-          parts.append(tail)
-    if arg_lists:
-      parts.append('\n')
-    for special in arg_lists:
-      parts.append('\n' + self.process_node(special))
-
-    return parts
-
-  def process_node(self, node):
-    """Processes a special node into a string"""
-    # Summary, remarks are just flattened
-    if node.tag in ("summary", "remarks", "xmldoc", "value"):
-      text = " ".join(self.flatten_node(node))
-      if node.tag != "xmldoc" and not text[-1] == ".":
-        text += "."
-      return text
-
-    if node.tag == "param":
-      name = node.get("name", '')
-      return ":param {}: {}".format(name, " ".join(self.flatten_node(node)))
-
-    if node.tag == "returns":
-      return ":returns: {}".format(" ".join(self.flatten_node(node)))
-
-    return ET.tostring(node)
-
-
+        self._inline(_cref_reference(attributes["cref"]))
+    elif "href" in attributes:
+      link = u"`{} <{}>`__".format(text or attributes["href"], attributes["href"])
+      if tag == "seealso":
+        self.references.append(link)
+      else:
+        self._inline(link)
+    elif "langword" in attributes:
+      self._inline(u"``{}``".format(attributes["langword"]))
+    elif text:
+      self.segment.append(text)
+
+  def _end_field(self, tag, attributes, body):
+    if tag == "param":
+      field = u":param {}:".format(attributes.get("name", ""))
+    elif tag == "typeparam":
+      field = u":typeparam {}:".format(attributes.get("name", ""))
+    elif tag == "exception":
+      field = u":throws {}:".format(_cref_name(attributes.get("cref", "")))
+    else:
+      field = ":returns:"
+    if body:
+      field += u" " + body[0]
+    self.fields.append(field)
+    # Anything further is indented to continue the field
+    self.fields.extend((u"   " + line).rstrip() for line in body[1:])
+
+  def close(self):
+    self._break_paragraph()
+    lines = self.lines
+    for extra in (self.fields, self._seealso()):
+      if extra:
+        if lines and lines[-1]:
+          lines.append("")
+        lines.extend(extra)
+    while lines and not lines[-1]:
+      lines.pop()
+    return lines
+
+  def _seealso(self):
+    if not self.references:
+      return []
+    return [u".. seealso:: " + ", ".join(self.references)]
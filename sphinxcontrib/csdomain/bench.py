@@ -0,0 +1,200 @@
+# coding: utf-8
+"""Benchmarks for the C# domain.
+
+``signatures`` times DefinitionParser over member signatures, either those
+autodoc finds in the .cs files under SOURCE_DIR or COUNT generated ones.
+``tree`` times finding the source files under SOURCE_DIR, as a :tree:
+module does, with os.walk and with the default include and exclude globs.
+``build`` generates a project of PAGES documents, each describing a class
+with methods and properties and cross-referencing its neighbours, then
+times a clean HTML build with 1 to MAX_JOBS parallel workers::
+
+  python -m sphinxcontrib.csdomain.bench signatures [SOURCE_DIR | COUNT]
+  python -m sphinxcontrib.csdomain.bench tree SOURCE_DIR
+  python -m sphinxcontrib.csdomain.bench build [DIRECTORY] [PAGES] [MAX_JOBS]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import timeit
+import fnmatch
+from .parser import DefinitionParser, DefinitionError
+
+_TYPES = ("int", "string", "bool", "double", "object", "IList<string>",
+          "Dictionary<string, List<int>>", "Task<IEnumerable<T>>")
+
+def generate_signatures(count):
+  """A reproducible mix of method, property and constructor signatures"""
+  signatures = []
+  for n in range(count):
+    kind = n % 4
+    ret = _TYPES[n % len(_TYPES)]
+    arg = _TYPES[(n // 4) % len(_TYPES)]
+    if kind == 0:
+      signatures.append("public static {} Method{}({} value, ref int count, "
+        "string name = \"default\")".format(ret, n, arg))
+    elif kind == 1:
+      signatures.append("[Obsolete(\"Use another\")] protected internal virtual "
+        "{} Generic{}<T>(this {} source, IList<T> items) "
+        "where T : class, new()".format(ret, n, arg))
+    elif kind == 2:
+      signatures.append("public {} Property{} {{ get; protected set; }}"
+        .format(ret, n))
+    else:
+      signatures.append("public Space.Name{}.Type{}({} first, out {} second)"
+        .format(n % 50, n, arg, ret))
+  return signatures
+
+def source_signatures(directory):
+  """The member signatures autodoc would emit for the .cs files in a tree"""
+  from .autodoc.directives import _read_source_file
+  signatures = []
+  for (root, _, files) in os.walk(directory):
+    for name in sorted(fnmatch.filter(files, "*.cs")):
+      (_, _, classes, _) = _read_source_file(os.path.join(root, name))
+      for cls in classes:
+        signatures.extend(member.signature() for member in cls.members)
+  return signatures
+
+def bench_signatures(signatures, repeat=3):
+  """Best time, in seconds, to parse every signature, and how many failed"""
+  def run():
+    failures = 0
+    for signature in signatures:
+      try:
+        DefinitionParser(signature).parse_member()
+      except (ValueError, DefinitionError):
+        failures += 1
+    return failures
+  failures = run()
+  return min(timeit.repeat(run, number=1, repeat=repeat)), failures
+
+def _walk_as_was(directory):
+  """:tree: discovery as it was, walking everything and stat'ing each file"""
+  files = []
+  for (root, _, names) in os.walk(directory):
+    for name in names:
+      if name.endswith(".cs") and os.path.isfile(os.path.join(root, name)):
+        files.append(os.path.join(root, name))
+  return files
+
+def bench_tree(directory, repeat=3):
+  """Best times to find the source files under a directory with os.walk and
+  with the default TreeFilter, and how many files each found"""
+  from .autodoc.tree import TreeFilter
+  tree_filter = TreeFilter()
+  walk = lambda: [path for (path, _) in tree_filter.walk(directory)]
+  results = []
+  for find in (lambda: _walk_as_was(directory), walk):
+    elapsed = min(timeit.repeat(find, number=1, repeat=repeat))
+    results.append((elapsed, len(find())))
+  return results
+
+_CONF = """\
+import sys
+sys.path.insert(0, {path!r})
+extensions = ["sphinxcontrib.csdomain", "sphinxcontrib.csdomain.autodoc"]
+master_doc = "index"
+source_suffix = ".rst"
+"""
+
+_PAGE = """\
+Class{n}
+========
+
+.. cs:namespace:: Bench.Space{space}
+
+.. cs:class:: public class Class{n} : Class{base}
+
+   The {n}th class, after :cs:class:`Class{base}`.
+
+   .. cs:method:: public int Compute(int value, string name = null)
+
+      Computes with :cs:class:`Bench.Space{next_space}.Class{next}`.
+
+      :param value: A value
+      :returns: Something
+
+   .. cs:property:: public string Name {{ get; set; }}
+
+      See :cs:member:`Class{next}.Compute`.
+"""
+
+def generate_project(directory, pages):
+  """Writes a conf.py, an index and the given number of class pages"""
+  package_root = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+  with open(os.path.join(directory, "conf.py"), "w") as f:
+    f.write(_CONF.format(path=package_root))
+  names = ["page{:05d}".format(n) for n in range(pages)]
+  with open(os.path.join(directory, "index.rst"), "w") as f:
+    f.write("Benchmark\n=========\n\n.. toctree::\n   :maxdepth: 1\n\n")
+    f.write("".join("   {}\n".format(name) for name in names))
+  for (n, name) in enumerate(names):
+    following = (n + 1) % pages
+    with open(os.path.join(directory, name + ".rst"), "w") as f:
+      f.write(_PAGE.format(n=n, space=n % 10, base=max(n - 1, 0),
+                           next=following, next_space=following % 10))
+
+def time_build(directory, jobs):
+  """Seconds taken for a clean HTML build with the given number of workers"""
+  output = os.path.join(directory, "_build")
+  if os.path.isdir(output):
+    shutil.rmtree(output)
+  command = [sys.executable, "-m", "sphinx", "-q", "-b", "html",
+             "-j", str(jobs), directory, output]
+  with open(os.devnull, "w") as devnull:
+    start = timeit.default_timer()
+    subprocess.check_call(command, stdout=devnull, stderr=devnull)
+    return timeit.default_timer() - start
+
+def main_signatures(argv):
+  if argv and os.path.isdir(argv[0]):
+    signatures = source_signatures(argv[0])
+  else:
+    signatures = generate_signatures(int(argv[0]) if argv else 50000)
+  elapsed, failures = bench_signatures(signatures)
+  print "{} signatures ({} not parsed) in {:.2f}s: {:.0f} signatures/s".format(
+    len(signatures), failures, elapsed, len(signatures) / elapsed)
+  return 0
+
+def main_tree(argv):
+  if not argv or not os.path.isdir(argv[0]):
+    print "Usage: python -m sphinxcontrib.csdomain.bench tree SOURCE_DIR"
+    return 1
+  ((before, walked), (after, found)) = bench_tree(argv[0])
+  print "os.walk:     {} files in {:.3f}s".format(walked, before)
+  print "TreeFilter:  {} files in {:.3f}s ({:.1f}x)".format(
+    found, after, before / after)
+  return 0
+
+def main_build(argv):
+  directory = argv[0] if argv else tempfile.mkdtemp(prefix="csdomain-bench-")
+  pages = int(argv[1]) if len(argv) > 1 else 2000
+  max_jobs = int(argv[2]) if len(argv) > 2 else 8
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  generate_project(directory, pages)
+  print "{} pages in {}".format(pages, directory)
+  serial = None
+  for jobs in range(1, max_jobs + 1):
+    elapsed = time_build(directory, jobs)
+    serial = serial or elapsed
+    print "  -j {}: {:.1f}s ({:.2f}x)".format(jobs, elapsed, serial / elapsed)
+  return 0
+
+def main(argv):
+  commands = {"signatures": main_signatures, "tree": main_tree,
+              "build": main_build}
+  if not argv or argv[0] not in commands:
+    print "Usage: python -m sphinxcontrib.csdomain.bench signatures [SOURCE_DIR | COUNT]"
+    print "       python -m sphinxcontrib.csdomain.bench tree SOURCE_DIR"
+    print "       python -m sphinxcontrib.csdomain.bench build [DIRECTORY] [PAGES] [MAX_JOBS]"
+    return 1
+  return commands[argv[0]](argv[1:])
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,7 @@
 #coding: utf-8
 
 import re
+import bisect
 
 from docutils.parsers.rst import directives
 from docutils import nodes
@@ -16,9 +17,11 @@ from sphinx.util.nodes import make_refnode
 from sphinx import addnodes
 
 from .parser import DefinitionParser, DefinitionError
+from .parser import parse_namespace, parse_signature
+from .parser import namespace_cache, signature_cache
 from .types import TypeInfo, MethodInfo, PropertyInfo, ClassInfo
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 def valid_identifier(string):
   return _identifier_re.match(string) is not None
@@ -33,6 +36,52 @@ def full_attribute_name(attribute_info):
 
   return " ".join(str(x) for x in attribute_info)
 
+def _reversed_key(fullname):
+  return (fullname.lower()[::-1], fullname)
+
+def _index_object(data, fullname, name):
+  """Adds an object to the cross-reference lookup tables"""
+  bisect.insort(data['reversed_names'], _reversed_key(fullname))
+  data['short_names'].setdefault(name._name.lower(), []).append(fullname)
+
+def _unindex_object(data, fullname, name):
+  """Removes an object from the cross-reference lookup tables"""
+  names = data['reversed_names']
+  key = _reversed_key(fullname)
+  index = bisect.bisect_left(names, key)
+  if index < len(names) and names[index] == key:
+    del names[index]
+  entries = data['short_names'].get(name._name.lower())
+  if entries and fullname in entries:
+    entries.remove(fullname)
+    if not entries:
+      del data['short_names'][name._name.lower()]
+
+def _add_object(env, fullname, entry, lineno=None):
+  """Records an object described in a document, entry being its (docname,
+  objtype, name). If it is already described in another document, the
+  first description is kept and the duplicate warned about, whether the
+  two were read in one process or merged from parallel readers."""
+  data = env.domaindata['cs']
+  objects = data['objects']
+  if fullname in objects:
+    if objects[fullname][0] != entry[0]:
+      env.warn(entry[0],
+        'duplicate C# description of {}, other instance in {}'
+        .format(fullname, env.doc2path(objects[fullname][0])), lineno)
+    return
+  objects[fullname] = entry
+  _index_object(data, fullname, entry[2])
+
+def _names_ending_with(data, target):
+  """Every full name ending with target, ignoring case, found by bisecting
+  the sorted reversed names rather than scanning every object"""
+  prefix = target.lower()[::-1]
+  names = data['reversed_names']
+  start = bisect.bisect_left(names, (prefix,))
+  end = bisect.bisect_left(names, (prefix + u"\uffff",))
+  return [fullname for (_, fullname) in names[start:end]]
+
 class CSObject(ObjectDescription):
 
   option_spec = {
@@ -43,6 +92,9 @@ class CSObject(ObjectDescription):
     GroupedField('parameter', label=l_('Parameters'),
                  names=('param', 'parameter', 'arg', 'argument'),
                  can_collapse=True),
+    GroupedField('typeparameter', label=l_('Type Parameters'),
+                 names=('typeparam', 'typeparameter'),
+                 can_collapse=True),
     GroupedField('exceptions', label=l_('Throws'), rolename='cpp:class',
                  names=('throws', 'throw', 'exception'),
                  can_collapse=True),
@@ -81,8 +133,8 @@ class CSObject(ObjectDescription):
       signode['first'] = (not self.names)
       self.state.document.note_explicit_target(signode)
 
-      self.env.domaindata['cs']['objects'].setdefault(idname, 
-        (self.env.docname, self.objtype, name))
+      _add_object(self.env, idname, (self.env.docname, self.objtype, name),
+                  self.lineno)
 
       indextext = self.get_index_text(name)
       if indextext:
@@ -160,8 +212,7 @@ class CSClassObject(CSObject):
     return _('{} (C# {})'.format(name._name, name._classlike_category))
 
   def handle_signature(self, sig, signode):
-    parser = DefinitionParser(sig)
-    clike = parser.parse_classlike()
+    clike = parse_signature(sig, "classlike")
 
     # Use the current namespace to build a fully qualified name
     curr_namespace = DefinitionParser.ParseNamespace(self.resolve_current_namespace())
@@ -221,12 +272,11 @@ class CSMemberObject(CSObject):
     return _('{} (C# {})'.format(name._name, membertype))
 
   def handle_signature(self, sig, signode):
-    parser = DefinitionParser(sig)
-    info = parser.parse_member()
+    info = parse_signature(sig)
 
     namespace = self.resolve_current_namespace()
     if namespace:
-      namespace_type = DefinitionParser(namespace)._parse_namespace_name()
+      namespace_type = parse_namespace(namespace)
 
       # Now, re-resolve with the parsed namespace
       if not info._full_name.fqn().startswith(namespace_type.fqn()):
@@ -332,8 +382,7 @@ class CSCurrentNamespace(Directive):
       env.temp_data['cs:namespace'] = None
     else:
       # Only allow alphanumeric and ./_
-      parser = DefinitionParser(self.arguments[0])
-      name = parser._parse_namespace_name()
+      name = parse_namespace(self.arguments[0])
       env.temp_data["cs:namespace"] = name.fqn()
     return []
 
@@ -395,17 +444,34 @@ class CSharpDomain(Domain):
       # 'data':   CXRefRole(),
       # 'type':   CXRefRole(),
   }
+  # Bump when the shape of the stored data changes, to discard old pickles
+  data_version = 9
   initial_data = {
       'objects': {},  # fullname -> docname, objtype
+      # sorted (reversed lowercased fullname, fullname), and lowercased short
+      # name -> [fullname], for find_obj
+      'reversed_names': [],
+      'short_names': {},
       'modules': {},
-      'namespaces': defaultdict(list),
+      # namespace -> {qualified class name: class}, in parse order
+      'namespaces': defaultdict(OrderedDict),
       'classes': {},
+      # source file -> [qualified class name], for removing a file's classes
+      'files': {},
+      # source files whose classes were only indexed, not parsed in full
+      'indexed': set(),
+      # docname -> [(path, tree)] of its cs:autodocmodule declarations
+      'module_docs': {},
+      # docname -> {cs:autodoc argument: digest of the class it rendered}
+      'rendered': {},
+      # dotted suffix of a class name -> [key in 'classes'], for cs:autodoc
+      'class_suffixes': {},
   }
 
   def find_obj(self, env, namespace, typ, target, node):
     objects = self.data['objects']
     # Find anything with the target
-    matches = [x for x in objects.iterkeys() if x.lower().endswith(target.lower())]
+    matches = _names_ending_with(self.data, target)
     # print "Found: " + str(matches)
     if len(matches) > 1:
       env.warn_node('more than one target found for cross-reference ', node)
@@ -413,9 +479,9 @@ class CSharpDomain(Domain):
       return objects[matches[0]]
 
     # Try direct names (ignoring, e.g. arguments)
-    matches = [x for x in objects.itervalues() if target.lower() == x[2]._name.lower()]
+    matches = self.data['short_names'].get(target.lower(), [])
     if len(matches) == 1:
-      return matches[0]
+      return objects[matches[0]]
 
     # Try a different approach. Look for all keys with this in
     matches = [x for x in objects.iterkeys() if target.lower() in x.lower()]
@@ -458,6 +524,29 @@ class CSharpDomain(Domain):
       yield (refname, refname, typen, docname, refname, 1)
 
   def clear_doc(self, docname):
-    for fullname, (fn, _, _) in self.data['objects'].items():
+    for fullname, (fn, _, name) in self.data['objects'].items():
       if fn == docname:
         del self.data['objects'][fullname]
+        _unindex_object(self.data, fullname, name)
+    self.data['module_docs'].pop(docname, None)
+    self.data['rendered'].pop(docname, None)
+
+  def merge_domaindata(self, docnames, otherdata):
+    """Merges in what a parallel reader collected from docnames. Source
+    files parsed by the reader are merged by autodoc, on env-merge-info"""
+    for fullname, entry in otherdata['objects'].iteritems():
+      if entry[0] in docnames:
+        _add_object(self.env, fullname, entry)
+    for key in ('module_docs', 'rendered'):
+      for docname in docnames:
+        if docname in otherdata[key]:
+          self.data[key][docname] = otherdata[key][docname]
+
+def log_parse_caches(app, exception):
+  """Reports how well parsing was cached, in verbose builds"""
+  for (name, cache) in (("namespace", namespace_cache),
+                        ("signature", signature_cache)):
+    lookups = cache.hits + cache.misses
+    if lookups:
+      app.verbose("C# {} cache: {} hits, {} misses ({:.0%} hit rate)"
+        .format(name, cache.hits, cache.misses, float(cache.hits) / lookups))
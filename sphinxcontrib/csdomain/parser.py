@@ -1,11 +1,22 @@
 # coding: utf-8
 
 import re
+from collections import OrderedDict
 from .types import *
 
 _identifier_re = re.compile(r'(~?\b[a-zA-Z_][a-zA-Z0-9_]*)\b')
 # _visibility_re = re.compile(r'\b(public|private|protected)\b')
 _whitespace_re = re.compile(r'\s+(?u)')
+_default_value_re = re.compile(r'[^,)]+')
+_attribute_arguments_re = re.compile(r"[^)]*")
+_constructor_modifiers = ('public', 'protected', 'internal', 'private', 'extern')
+
+# The keywords and punctuation the parser skips over, compiled up front
+# rather than on every call. Anything else is compiled on first use.
+_word_res = dict((word, re.compile(r'\b%s\b' % re.escape(word)))
+  for word in ("partial", "where", "get", "set", "class", "interface"))
+_character_res = dict((char, re.compile(re.escape(char)))
+  for char in ("(", ")", "<", ">", "[", "]", "{", "}", ",", ".", ":", ";", "="))
 
 class DefinitionError(Exception):
   def __init__(self, description):
@@ -17,6 +28,86 @@ class DefinitionError(Exception):
   def __unicode__(self):
     return self.description
 
+class _LRUCache(object):
+  """Least-recently-used cache of parse results, keyed on the parsed text"""
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self._entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    try:
+      value = self._entries.pop(key)
+    except KeyError:
+      self.misses += 1
+      value = self._parse(key)
+      if len(self._entries) >= self.max_size:
+        self._entries.popitem(last=False)
+    else:
+      self.hits += 1
+    self._entries[key] = value
+    return value
+
+  def clear(self):
+    self._entries.clear()
+    self.hits = 0
+    self.misses = 0
+
+class NamespaceCache(_LRUCache):
+  """Least-recently-used cache of parsed namespace names.
+
+  The same few namespaces are parsed over and over while resolving a
+  build's signatures and references, so each is parsed once and the
+  resulting TypeInfo frozen and shared between every caller."""
+  def __init__(self, max_size=1024):
+    super(NamespaceCache, self).__init__(max_size)
+
+  def get(self, name):
+    """The frozen TypeInfo for a namespace name. Raises DefinitionError"""
+    return super(NamespaceCache, self).get(name)
+
+  def _parse(self, name):
+    return DefinitionParser(name)._parse_namespace_name().freeze()
+
+class SignatureCache(_LRUCache):
+  """Least-recently-used cache of parsed class and member signatures.
+
+  Overloads, interface implementations and repeated pages describe the
+  same signatures many times over. Results are kept frozen, failures
+  included, and every caller gets its own copy."""
+  def __init__(self, max_size=4096):
+    super(SignatureCache, self).__init__(max_size)
+
+  def get(self, signature, kind="member"):
+    """A copy of the parse of a "member" or "classlike" signature. Raises
+    ValueError or DefinitionError as the parse would have."""
+    (value, error) = super(SignatureCache, self).get((kind, signature))
+    if error is not None:
+      raise error
+    return value.copy()
+
+  def _parse(self, key):
+    (kind, signature) = key
+    parser = DefinitionParser(signature)
+    try:
+      if kind == "classlike":
+        return (parser.parse_classlike().freeze(), None)
+      return (parser.parse_member().freeze(), None)
+    except (ValueError, DefinitionError) as ex:
+      return (None, ex)
+
+namespace_cache = NamespaceCache()
+signature_cache = SignatureCache()
+
+def parse_namespace(name):
+  """Parses a namespace or type name into a shared, immutable TypeInfo"""
+  return namespace_cache.get(name)
+
+def parse_signature(signature, kind="member"):
+  """Parses a "member" or "classlike" signature, through the shared cache"""
+  return signature_cache.get(signature, kind)
+
 class DefinitionParser(object):
   def __init__(self, definition):
     if definition:
@@ -34,10 +125,16 @@ class DefinitionParser(object):
           .format(msg, self.pos, self.definition, " "*(self.pos)))
 
   def skip_word(self, word):
-    return self.match(re.compile(r'\b%s\b' % re.escape(word)))
+    regex = _word_res.get(word)
+    if regex is None:
+      regex = _word_res[word] = re.compile(r'\b%s\b' % re.escape(word))
+    return self.match(regex)
 
   def skip_character(self, char):
-    return self.match(re.compile(re.escape(char)))
+    regex = _character_res.get(char)
+    if regex is None:
+      regex = _character_res[char] = re.compile(re.escape(char))
+    return self.match(regex)
 
   def skip_character_and_ws(self, char):
     if self.skip_character(char):
@@ -93,14 +190,29 @@ class DefinitionParser(object):
     if self.last_match is not None:
       return self.last_match.group()
 
+  def _next_character(self):
+    return self.definition[self.pos:self.pos + 1]
+
   @property
   def eof(self):
       return self.pos >= self.end
 
+  @staticmethod
+  def parse_many(signatures, kind="member"):
+    """Parses a batch of "member" or "classlike" signatures through the
+    shared cache. Returns a result for each, None where it did not parse."""
+    results = []
+    for signature in signatures:
+      try:
+        results.append(signature_cache.get(signature, kind))
+      except (ValueError, DefinitionError):
+        results.append(None)
+    return results
+
   @staticmethod
   def ParseNamespace(name):
     try:
-      return DefinitionParser(name)._parse_namespace_name()
+      return parse_namespace(name)
     except DefinitionError:
       return None
 
@@ -175,7 +287,7 @@ class DefinitionParser(object):
 
     clike._modifiers = self._parse_class_modifiers()
     clike._partial = self.skip_word_and_ws("partial")
-    self.swallow_character_and_ws('class')
+    self.swallow_word_and_ws('class')
     clike._full_name = self._parse_type_name()
     clike._name = clike._full_name._name
     # Optional type-parameter list
@@ -218,7 +330,7 @@ class DefinitionParser(object):
     cinfo._modifiers = self._parse_modifiers(('new', 'public', 'protected',
       'internal', 'private'))
     cinfo._partial = self.skip_word_and_ws('partial')
-    self.swallow_character_and_ws('interface')
+    self.swallow_word_and_ws('interface')
     cinfo._classlike_category = 'interface'
     cinfo._full_name = self._parse_type_name()
     cinfo._name = cinfo._full_name._name
@@ -258,9 +370,12 @@ class DefinitionParser(object):
     method._name = method._full_name._name
 
     # The argument list
-    self.swallow_character_and_ws('(')
-    method._arguments = self._parse_formal_argument_list()
-    self.swallow_character_and_ws(')')
+    self._parse_method_tail(method)
+    return method
+
+  def _parse_method_tail(self, method):
+    """Parses a method's argument list and anything following it"""
+    self._parse_parenthesized_arguments(method)
 
     type_parameter_list = self._parse_type_parameter_list()
 
@@ -268,11 +383,78 @@ class DefinitionParser(object):
 
     constraints = self._parse_type_parameter_constraints_clauses()
 
-    return method
+  def _parse_parenthesized_arguments(self, method):
+    self.swallow_character_and_ws('(')
+    method._arguments = self._parse_formal_argument_list()
+    self.swallow_character_and_ws(')')
+
+  def _parse_member_predictively(self):
+    """Parses a method, property or constructor in a single pass.
+
+    Attributes, modifiers and the first type are common to all three; then
+    a '(' means a constructor, and otherwise the name is followed by '(' for
+    a method or '{' for a property. Returns None where every grammar would
+    fail at the same point, and raises DefinitionError for anything else it
+    cannot decide, including the forms that only the constructor or method
+    grammars would accept on their own."""
+    try:
+      attributes = self._parse_attributes()
+    except DefinitionError:
+      return None
+    modifiers = self._parse_method_modifiers()
+    partial = self.skip_word_and_ws('partial')
+    try:
+      first = self._parse_type()
+    except DefinitionError:
+      if partial or not set(modifiers).issubset(_constructor_modifiers):
+        raise
+      return None
+    if self._next_character() == '(':
+      if partial or not set(modifiers).issubset(_constructor_modifiers):
+        raise DefinitionError("Not a simple constructor")
+      method = MethodInfo()
+      method._attributes = attributes
+      method._modifiers = modifiers
+      method._full_name = first
+      method._name = first._name
+      method._member_category = "constructor"
+      self._parse_parenthesized_arguments(method)
+      return method
+
+    name = self._parse_type_name()
+    following = self._next_character()
+    if following == '(':
+      method = MethodInfo()
+      method._attributes = attributes
+      method._modifiers = modifiers
+      method._type = first
+      method._full_name = name
+      method._name = name._name
+      self._parse_method_tail(method)
+      return method
+    if following == '{' and not partial:
+      prop = PropertyInfo()
+      prop._attributes = attributes
+      prop._modifiers = modifiers
+      prop._type = first
+      prop._full_name = name
+      prop._name = name._name
+      self._parse_accessor_block(prop)
+      return prop
+    raise DefinitionError("Not a simple method or property")
 
   def _parse_class_member_declaration(self):
     state = (self.pos, self.last_match)
-    # Attempt to parse a methd
+    try:
+      member = self._parse_member_predictively()
+    except DefinitionError:
+      self.pos, self.last_match = state
+    else:
+      if member is not None:
+        return member
+      self.pos, self.last_match = state
+      raise ValueError("Could not determine member type for " + self.definition[self.pos:])
+    # Otherwise, try each grammar in turn. Attempt to parse a methd
     try:
       return self._parse_method_header()
     except DefinitionError:
@@ -308,9 +490,7 @@ class DefinitionParser(object):
     method._full_name = self._parse_type_name()
     method._name = method._full_name._name
     method._member_category = "constructor"
-    self.swallow_character_and_ws('(')
-    method._arguments = self._parse_formal_argument_list()
-    self.swallow_character_and_ws(')')
+    self._parse_parenthesized_arguments(method)
     return method
 
   def _parse_property_declaration(self):
@@ -321,7 +501,11 @@ class DefinitionParser(object):
     prop._type = self._parse_type()
     prop._full_name = self._parse_type_name()
     prop._name = prop._full_name._name
-    
+    self._parse_accessor_block(prop)
+    return prop
+
+  def _parse_accessor_block(self, prop):
+    """Parses the { get; set; } of a property"""
     self.swallow_character_and_ws('{')
     ac = self._parse_accessor_declaration()
     if ac:
@@ -340,7 +524,6 @@ class DefinitionParser(object):
       pass
 
     self.swallow_character_and_ws('}')
-    return prop
 
   def _parse_accessor_declaration(self):
     ai = MemberInfo()
@@ -400,7 +583,7 @@ class DefinitionParser(object):
     expression = None
     if self.skip_character_and_ws('='):
       # For now, skip until the next , or )
-      self.match(re.compile(r'[^,)]+'))
+      self.match(_default_value_re)
       expression = self.matched_text
     return {
       'attributes': attributes,
@@ -434,8 +617,7 @@ class DefinitionParser(object):
     return self._parse_modifiers(valid_modifiers)
 
   def _parse_constructor_modifiers(self):
-    valid_modifiers = ('public', 'protected', 'internal', 'private', 'extern')
-    return self._parse_modifiers(valid_modifiers)
+    return self._parse_modifiers(_constructor_modifiers)
 
   def _parse_method_modifiers(self):
     return self._parse_modifiers(MethodInfo.valid_modifiers)
@@ -503,7 +685,7 @@ class DefinitionParser(object):
     if not self.skip_character_and_ws('('):
       return []
     # Skip anything until the end )
-    self.match(re.compile(r"[^)]*"))
+    self.match(_attribute_arguments_re)
     value = self.matched_text
     self.swallow_character_and_ws(')')
     return [value]
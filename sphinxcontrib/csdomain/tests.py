@@ -1,8 +1,14 @@
 # coding: utf-8
 
 import unittest
-from .parser import DefinitionParser
-from .types import PropertyInfo
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+from .parser import DefinitionParser, NamespaceCache, SignatureCache
+from .types import PropertyInfo, TypeInfo
+from .csdomain import CSharpDomain, _index_object, _add_object
+from .bench import source_signatures
 
 class TestDefinitionParser(unittest.TestCase):
   def testInit(self):
@@ -32,6 +38,12 @@ class TestDefinitionParser(unittest.TestCase):
     cl = DefinitionParser('public interface ITC : IViewModel').parse_classlike()
     assert ["IViewModel"] == [x.fqn() for x in cl._bases]
 
+  def testKeywordNeedsBoundary(self):
+    with self.assertRaises(ValueError):
+      DefinitionParser('public classTC').parse_classlike()
+    with self.assertRaises(ValueError):
+      DefinitionParser('public interfaceITC').parse_classlike()
+
 
   def testMethodMember(self):
     data = "public void SetError(bool hasError, string description = null, [CallerMemberName] string property = null)"
@@ -77,4 +89,202 @@ class TestParts(unittest.TestCase):
     dp = DefinitionParser("test.namespace.ViewModel")
     tn = dp._parse_type_name()
     self.assertEqual(tn._name, "ViewModel")
-    self.assertEqual(tn.fqn(), "test.namespace.ViewModel")
\ No newline at end of file
+    self.assertEqual(tn.fqn(), "test.namespace.ViewModel")
+
+class _Environment(object):
+  """Just enough of a BuildEnvironment to hold domain data"""
+  def __init__(self):
+    self.domaindata = {}
+    self.warnings = []
+
+  def warn_node(self, msg, node):
+    self.warnings.append(msg)
+
+  def warn(self, docname, msg, lineno=None):
+    self.warnings.append(msg)
+
+  def doc2path(self, docname):
+    return docname + ".rst"
+
+class TestFindObj(unittest.TestCase):
+  def setUp(self):
+    self.env = _Environment()
+    self.domain = CSharpDomain(self.env)
+    for fullname in ["Space.Widget", "Space.Widget.Draw", "Other.Widget",
+                     "Other.MyGadget"]:
+      self._add(fullname)
+
+  def _add(self, fullname, docname="doc"):
+    name = DefinitionParser.ParseNamespace(fullname)
+    self.domain.data['objects'][fullname] = (docname, "class", name)
+    _index_object(self.domain.data, fullname, name)
+
+  def _find(self, target):
+    match = self.domain.find_obj(self.env, None, "class", target, None)
+    return match and match[2].fqn()
+
+  def test_dotted_suffix(self):
+    self.assertEqual(self._find("widget.draw"), "Space.Widget.Draw")
+    self.assertEqual(self._find("Space.Widget"), "Space.Widget")
+    self.assertEqual(self.env.warnings, [])
+
+  def test_ambiguous(self):
+    self.assertEqual(self._find("Widget"), None)
+    self.assertEqual(len(self.env.warnings), 2)
+
+  def test_partial_name_fallback(self):
+    self.assertEqual(self._find("Gadget"), "Other.MyGadget")
+    # Partial names are still tried before short names, as they always were
+    self._add("X.Gadget(int)")
+    self.assertEqual(self._find("Gadget"), "Other.MyGadget")
+    self.assertEqual(self.env.warnings, [])
+
+  def test_clear_doc(self):
+    self._add("Third.Gizmo", "other")
+    self.assertEqual(self._find("Gizmo"), "Third.Gizmo")
+    self.domain.clear_doc("other")
+    self.assertEqual(self._find("Gizmo"), None)
+    self.assertNotIn(("omzig.driht", "Third.Gizmo"),
+                     self.domain.data['reversed_names'])
+    self.assertNotIn("gizmo", self.domain.data['short_names'])
+
+  def test_duplicates_warn_and_keep_first(self):
+    # As a serial build adds them, from add_target_and_index
+    name = DefinitionParser.ParseNamespace("Space.Widget")
+    _add_object(self.env, "Space.Widget", ("other", "class", name), 12)
+    _add_object(self.env, "Space.Widget", ("doc", "class", name))
+    self.assertEqual(self.domain.data['objects']["Space.Widget"][0], "doc")
+    self.assertEqual(len(self.env.warnings), 1)
+    # ...and as merging a parallel reader's data does
+    reader = CSharpDomain(_Environment())
+    reader.data['objects']["Space.Widget"] = ("other", "class", name)
+    self.domain.merge_domaindata(["other"], reader.data)
+    self.assertEqual(self.domain.data['objects']["Space.Widget"][0], "doc")
+    self.assertEqual(len(self.env.warnings), 2)
+
+  def test_merge_domaindata(self):
+    reader = CSharpDomain(_Environment())
+    for (fullname, docname) in [("Third.Gizmo", "other"),
+                                ("Space.Widget", "other"),
+                                ("Ignored.Thing", "elsewhere")]:
+      name = DefinitionParser.ParseNamespace(fullname)
+      reader.data['objects'][fullname] = (docname, "class", name)
+    reader.data['rendered']["other"] = {"Gizmo": "digest"}
+    self.domain.merge_domaindata(["other"], reader.data)
+    self.assertEqual(self._find("Gizmo"), "Third.Gizmo")
+    self.assertEqual(self._find("Thing"), None)
+    # The first description wins, with a warning about the duplicate
+    self.assertEqual(self.domain.data['objects']["Space.Widget"][0], "doc")
+    self.assertEqual(len(self.env.warnings), 1)
+    self.assertEqual(self.domain.data['rendered']["other"],
+                     {"Gizmo": "digest"})
+
+class TestNamespaceCache(unittest.TestCase):
+  def test_shared_and_frozen(self):
+    cache = NamespaceCache()
+    first = cache.get("System.Collections.Generic.List<int>")
+    self.assertIs(cache.get("System.Collections.Generic.List<int>"), first)
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+    self.assertEqual(first.fqn(), "System.Collections.Generic.List<int>")
+    with self.assertRaises(AttributeError):
+      first.deepest_namespace()._namespace = None
+    with self.assertRaises(AttributeError):
+      first._arguments[0]._name = "long"
+
+  def test_evicts_least_recently_used(self):
+    cache = NamespaceCache(max_size=2)
+    first = cache.get("A")
+    cache.get("B")
+    cache.get("A")
+    cache.get("C")
+    self.assertIs(cache.get("A"), first)
+    self.assertEqual(cache.misses, 3)
+    cache.get("B")
+    self.assertEqual(cache.misses, 4)
+
+  def test_merge_onto_shared_namespace(self):
+    name = DefinitionParser("class Widget").parse_classlike()._full_name
+    namespace = DefinitionParser.ParseNamespace("Space.Inner")
+    name.merge_onto(namespace)
+    self.assertEqual(name.fqn(), "Space.Inner.Widget")
+    self.assertEqual(namespace.fqn(), "Space.Inner")
+
+class TestTypeInfoNames(unittest.TestCase):
+  def test_rewiring_invalidates_cached_names(self):
+    name = DefinitionParser.ParseNamespace("Outer.Inner")
+    member = DefinitionParser("void Run()").parse_member()._full_name
+    member.merge_onto(name)
+    self.assertEqual(member.fqn(), "Outer.Inner.Run")
+    inner = DefinitionParser("Middle.Widget")._parse_namespace_name()
+    self.assertEqual(inner.fqn(), "Middle.Widget")
+    self.assertEqual(inner.flatten_namespace(), ["Middle", "Widget"])
+    inner.deepest_namespace()._namespace = name
+    self.assertEqual(inner.fqn(), "Outer.Inner.Middle.Widget")
+    self.assertEqual(inner.namespace_fqn(), "Outer.Inner.Middle")
+    self.assertEqual(inner.flatten_namespace(),
+                     ["Outer", "Inner", "Middle", "Widget"])
+
+  def test_rewiring_keeps_other_chains_cached(self):
+    other = DefinitionParser("Space.Item")._parse_namespace_name()
+    parts = other._flattened()
+    inner = DefinitionParser("Middle.Widget")._parse_namespace_name()
+    inner.fqn()
+    inner.deepest_namespace()._namespace = TypeInfo("Outer")
+    self.assertEqual(inner.fqn(), "Outer.Middle.Widget")
+    self.assertIs(other._flattened(), parts)
+
+  def test_pickle(self):
+    name = DefinitionParser("Space.List<Space.Item>")._parse_namespace_name()
+    name.fqn()
+    copy = pickle.loads(pickle.dumps(name, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(copy.fqn(), "Space.List<Space.Item>")
+    frozen = pickle.loads(pickle.dumps(name.freeze()))
+    self.assertEqual(frozen.fqn(), "Space.List<Space.Item>")
+    with self.assertRaises(AttributeError):
+      frozen._namespace = None
+
+class TestSignatureCache(unittest.TestCase):
+  def test_copies_are_independent(self):
+    cache = SignatureCache()
+    signature = "public static int Space.Run(int count)"
+    first = cache.get(signature)
+    first._modifiers.remove("public")
+    first._full_name.deepest_namespace()._namespace = \
+      DefinitionParser.ParseNamespace("Outer")
+    second = cache.get(signature)
+    self.assertIsNot(second, first)
+    self.assertEqual(second._modifiers, ["public", "static"])
+    self.assertEqual(second._full_name.fqn(), "Space.Run")
+    self.assertEqual(first._full_name.fqn(), "Outer.Space.Run")
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+  def test_classlike_and_failures(self):
+    cache = SignatureCache()
+    self.assertEqual(cache.get("public class Widget", "classlike")._name,
+                     "Widget")
+    for _ in range(2):
+      with self.assertRaises(ValueError):
+        cache.get("<field-declaration: [u'Instance']>")
+    self.assertEqual(cache.misses, 2)
+
+  def test_parse_many(self):
+    results = DefinitionParser.parse_many(["int A()", "nonsense",
+                                           "string B { get; }", "int A()"])
+    self.assertEqual([x and x._member_category for x in results],
+                     ["method", None, "property", "method"])
+    self.assertIsNot(results[0], results[3])
+
+class TestBench(unittest.TestCase):
+  def test_source_signatures(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      os.mkdir(os.path.join(tempdir, "Sub"))
+      for (name, text) in [
+          ("A.cs", "namespace Space { class A { int F(string s) { } } }"),
+          (os.path.join("Sub", "B.cs"), "class B { bool P { get; set; } }")]:
+        with open(os.path.join(tempdir, name), "w") as f:
+          f.write(text)
+      self.assertEqual(source_signatures(tempdir),
+                       ["int F(string s)", "bool P { get; set; }"])
+    finally:
+      shutil.rmtree(tempdir)
@@ -1,6 +1,23 @@
 # coding: utf-8
 
-class MemberInfo(object):
+import copy
+
+class _SharedInfo(object):
+  """A parse result that can be cached: the cache keeps a frozen instance,
+  and hands each directive its own copy to adjust"""
+  def freeze(self):
+    self._modifiers = tuple(self._modifiers)
+    self._full_name.freeze()
+    return self
+
+  def copy(self):
+    """A copy whose modifiers and name chain can be changed freely"""
+    other = copy.copy(self)
+    other._modifiers = list(self._modifiers)
+    other._full_name = self._full_name.copy()
+    return other
+
+class MemberInfo(_SharedInfo):
   _attributes = []
   _modifiers = []
   _name = None
@@ -72,7 +89,7 @@ class AttributeInfo(object):
       fs += "(" + ", ".join(self._arguments) + ")"
     return fs
 
-class ClassInfo(object):
+class ClassInfo(_SharedInfo):
   _name = None
   _type_parameters = []
   _type_parameter_constraints = []
@@ -94,39 +111,103 @@ class ClassInfo(object):
     return 'static' in self._modifiers
 
 class TypeInfo(object):
-  _name = None
-  _arguments = None
-  _full = None
-  _namespace = None
+  """A, possibly generic, type or namespace name, linked to its enclosing
+  namespace. The dotted name of the whole chain is cached, along with the
+  parts of the namespace's name it was built from; if those are no longer
+  the parts the namespace caches, something up the chain was rewired."""
+  __slots__ = ("_name", "_arguments", "_full", "_parent", "_frozen",
+               "_parts", "_fqn", "_parent_parts")
 
   def __init__(self, name, arguments=[]):
+    object.__setattr__(self, "_frozen", False)
     self._name = name
     self._arguments = arguments
+    self._parent = None
+    self._parts = None
 
     if len(self._arguments):
       self._full = "{}<{}>".format(name, ', '.join(x.fqn() for x in arguments))
     else:
       self._full = name
 
+  def __setattr__(self, name, value):
+    if self._frozen:
+      raise AttributeError("{!r} is shared, and cannot be changed".format(self))
+    object.__setattr__(self, name, value)
+
+  @property
+  def _namespace(self):
+    return self._parent
+
+  @_namespace.setter
+  def _namespace(self, namespace):
+    self._parent = namespace
+    # Names further down the chain see that ours changed when next asked
+    self._parts = None
+
+  # Pickle as a tuple, leaving out the cached names
+  def __getstate__(self):
+    return (self._name, self._arguments, self._full, self._parent,
+            self._frozen)
+
+  def __setstate__(self, state):
+    for (name, value) in zip(("_name", "_arguments", "_full", "_parent",
+                              "_frozen"), state):
+      object.__setattr__(self, name, value)
+    object.__setattr__(self, "_parts", None)
+
+  def freeze(self):
+    """Makes this type, its arguments and its namespaces immutable, so that
+    one instance can be shared. Returns self."""
+    if not self._frozen:
+      for argument in self._arguments:
+        argument.freeze()
+      if self._parent:
+        self._parent.freeze()
+      self._arguments = tuple(self._arguments)
+      self._parts = None
+      self._frozen = True
+    return self
+
+  def copy(self):
+    """An unfrozen copy of this name and its namespaces, which can then be
+    rewired. Type arguments are shared."""
+    other = TypeInfo.__new__(TypeInfo)
+    for name in ("_name", "_arguments", "_full"):
+      object.__setattr__(other, name, getattr(self, name))
+    object.__setattr__(other, "_frozen", False)
+    object.__setattr__(other, "_parent",
+                       self._parent.copy() if self._parent else None)
+    object.__setattr__(other, "_parts", None)
+    return other
+
+  def _flattened(self):
+    # Frozen chains never change, so their cache never goes stale
+    if self._frozen and self._parts is not None:
+      return self._parts
+    parent_parts = self._parent._flattened() if self._parent else ()
+    if self._parts is None or parent_parts is not self._parent_parts:
+      parts = parent_parts + (self._full,)
+      object.__setattr__(self, "_parts", parts)
+      object.__setattr__(self, "_fqn", ".".join(parts))
+      object.__setattr__(self, "_parent_parts", parent_parts)
+    return self._parts
+
   def fqn(self):
-    alln = [self._full]
-    if self._namespace:
-      alln = [self._namespace.fqn(), self._full]
-    return ".".join(alln)
+    self._flattened()
+    return self._fqn
 
   def deepest_namespace(self):
-    if self._namespace:
-      return self._namespace.deepest_namespace()
+    if self._parent:
+      return self._parent.deepest_namespace()
     return self
   def namespace_fqn(self):
-    if self._namespace:
-      return self._namespace.fqn()
+    if self._parent:
+      return self._parent.fqn()
     return None
   
   def flatten_namespace(self):
-    if self._namespace:
-      return self._namespace.flatten_namespace() + [self._full]
-    return [self._full]
+    return list(self._flattened())
 
   def merge_onto(self, namespace):
     """Merges the existing typeinfo onto another namespace."""